@@ -4,14 +4,21 @@ from pydantic import BaseModel, Field
 
 
 class Search(BaseModel):
-    """Search for a regex in the repository. Will search through file names and their contents."""
+    """Search for a regex in the repository. Will search through file names and their contents.
+    Matching files are grouped and ranked: source before tests, docs and vendored code, files defining a match first."""
 
     regex: str = Field(
         ...,
         description="Regex to search for. Matches will be returned",
     )
+    cursor: int = Field(
+        0,
+        description="Rank of the first matching file to show. Use the cursor given at the end of a previous search to see more files.",
+    )
 
     def __str__(self):
+        if self.cursor:
+            return f"Searching for {self.regex} from file {self.cursor}"
         return f"Searching for {self.regex}"
 
 
@@ -31,11 +38,45 @@ class ViewFile(BaseModel):
         ge=100,
         description="Number of lines to display after the cursor line.",
     )
+    full: bool = Field(
+        False,
+        description="Lines you already viewed are only shown again if they changed. Set to true to see the whole window anyway.",
+    )
 
     def __str__(self):
         return f"Viewing {self.file_path} from {self.cursor_line-self.before} |{self.cursor_line}| {self.cursor_line+self.after}."
 
 
+class Explore(BaseModel):
+    """Run several searches and file views at once. Use this to look at multiple candidate files or patterns in a single step."""
+
+    searches: list[Search] = Field(
+        ...,
+        max_length=5,
+        description="Searches to run. Can be empty.",
+    )
+    views: list[ViewFile] = Field(
+        ...,
+        max_length=5,
+        description="File views to run. Can be empty.",
+    )
+
+    def __str__(self):
+        return "\n".join(str(read) for read in [*self.searches, *self.views])
+
+
+class RepoMap(BaseModel):
+    """Get a compact map of the repository: every python module with its top level classes and functions. Cheap, use it to find where things live."""
+
+    directory: str = Field(
+        ...,
+        description="Only map the modules under this directory. Use an empty string for the whole repository.",
+    )
+
+    def __str__(self):
+        return f"Mapping {self.directory or 'the repository'}"
+
+
 class CreateFile(BaseModel):
     """Create a new file in the repository."""
 
@@ -130,12 +171,16 @@ class Action(BaseModel):
         "edits",
         "submit",
         "view_file",
+        "explore",
+        "repo_map",
     ] = Field(..., description="The action to take.")
     action_input: Union[
         Search,
         Edits,
         Submit,
         ViewFile,
+        Explore,
+        RepoMap,
     ]
 
 
@@ -1,25 +1,47 @@
 import asyncio
 import os
-import re
-from typing import cast
+import time
+from collections import OrderedDict
+from typing import Optional, cast
 
 from opperai import fn, start_span, trace
 
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+
+from delvin.github import apply_patch, get_diff
+from delvin.log import log_event, progress
+from delvin.routing import router
 
 from .actions import (
     Action,
     ActionWithResult,
     CreateFile,
     Edits,
+    Explore,
+    RepoMap,
     Search,
     Trajectory,
     ViewFile,
 )
+from .checkpoint import Checkpoint, append_checkpoint, load_checkpoints
 from .edit import edit_files
 from .functions import evaluate_action
-from .view import view_file
+from .gating import EvaluationGate
+from .prompt import PromptTracker, action_schema
+from .repo_map import ensure_repo_map, filter_repo_map
+from .search import (
+    SEARCH_TIMEOUT,
+    FileMatches,
+    SearchResult,
+    format_files,
+    format_names,
+    rank_files,
+    run_search,
+)
+from .view import ViewHistory, view_file
+
+SEARCH_RESULTS_KEPT = 4
 
 
 class Agent(BaseModel):
@@ -30,11 +52,32 @@ class Agent(BaseModel):
     other_info: str = ""
     trajectory: Trajectory = Trajectory(actions=[])
     evaluate: bool = False
+    gate: EvaluationGate = EvaluationGate()
+    evaluations_run: int = 0
+    evaluations_skipped: int = 0
+    checkpoint_path: Optional[str] = None
+    repo_map_path: Optional[str] = None
+    search_index_path: Optional[str] = None
     instance_id: str = ""
+    search_timeout: float = SEARCH_TIMEOUT
+    action_timeout: float = 60.0
+    _prompt_trackers: dict[str, PromptTracker] = PrivateAttr(default_factory=dict)
+    _view_history: ViewHistory = PrivateAttr(default_factory=ViewHistory)
+    _created_files: set[str] = PrivateAttr(default_factory=set)
+    # regex -> result and ranking of its last first page search, for the SEARCH_RESULTS_KEPT most recent
+    # regexes, dropped whenever files change
+    _search_results: OrderedDict[str, tuple[SearchResult, list[FileMatches]]] = (
+        PrivateAttr(default_factory=OrderedDict)
+    )
+
+    @property
+    def step(self) -> int:
+        """Index of the step being run."""
+        return len(self.trajectory.actions)
 
     @fn()
     async def get_action(
-        trajectory: Trajectory, problem: str, other_info: str
+        problem: str, other_info: str, trajectory: Trajectory
     ) -> Action:
         """
         You are a world class programmer tasked with solving the given problem as simply as possible but without taking any shortcuts.
@@ -49,6 +92,8 @@ class Agent(BaseModel):
          - reuse existing code when possible. You should prioritize reuse. Don't hesisate to search and scroll through files.
 
         Extra rules:
+        - Use the explore action to run several searches and file views in a single step when you can.
+        - Use the repo_map action to find which modules define what before searching blindly.
         - Do not open a file without confirming it exists via search first
         - Do not get stuck on file names, be ready to expand your search a bit.
 
@@ -56,33 +101,34 @@ class Agent(BaseModel):
         you can search for it.
         """
 
-    async def code_search(self, regex: str) -> str:
+    def viewed_files(self) -> set[str]:
+        return {os.path.normpath(path) for path in self._view_history.files}
+
+    async def code_search(self, regex: str, cursor: int = 0) -> str:
         """Search for files with the regex in the contents, excluding directories starting with '.'.
-        Return the file names along with the line number and the line where the regex appears."""
-        matches = []
-        compiled_regex = re.compile(regex)
-        for root, _, filenames in await asyncio.to_thread(os.walk, self.path):
-            if "/." in root or root.endswith("/."):
-                continue  # Skip hidden directories
-            for filename in filenames:
-                file_path = os.path.join(root, filename)
-                try:
-                    with await asyncio.to_thread(
-                        open, file_path, "r", encoding="utf-8", errors="ignore"
-                    ) as file:
-                        for line_number, line in enumerate(file, start=1):
-                            if compiled_regex.search(line):
-                                relative_path = os.path.relpath(file_path, self.path)
-                                matches.append(
-                                    f"- {relative_path} line {line_number} : {line.strip()[0:120]}"
-                                )
-                                if len(matches) >= 100:
-                                    return "\n".join(matches)
-                except Exception:
-                    continue  # If there's an error opening/reading a file, skip it
-        if len(matches) == 0:
-            return f"No files containing '{regex}' found."
-        return "\n".join(matches[:100])
+        Return one page of the matching files ranked by relevance, with their match count and first matching lines.
+        Later pages come from the ranking of the first one, so that a cursor neither skips nor repeats files."""
+        if cursor and regex in self._search_results:
+            search, ranked = self._search_results[regex]
+            self._search_results.move_to_end(regex)
+        else:
+            search = await run_search(
+                self.path,
+                regex,
+                timeout=self.search_timeout,
+                index_path=self.search_index_path,
+                extra_files=sorted(self._created_files),
+            )
+            ranked = rank_files(search.files, self.viewed_files())
+            self._search_results[regex] = (search, ranked)
+            self._search_results.move_to_end(regex)
+            while len(self._search_results) > SEARCH_RESULTS_KEPT:
+                self._search_results.popitem(last=False)
+        if len(search.files) == 0:
+            return f"No files containing '{regex}' found. {search.notes()}".strip()
+        page = format_files(ranked, self.viewed_files(), cursor)
+        summary = f"{search.match_count} matches in {len(search.files)} files, source first, then tests, docs and vendored code:"
+        return "\n".join([summary, page, search.notes()]).strip()
 
     @trace
     async def edit_file(self, edit_input: Edits) -> str:
@@ -96,81 +142,205 @@ class Agent(BaseModel):
         try:
             with open(file_path, "w") as file:
                 file.write(create_input.contents)
+            self._created_files.add(os.path.normpath(create_input.file_path))
             return f"Created file: {create_input.file_path}"
         except Exception as e:
             return f"Failed to create file: {create_input.file_path}. Error: {e}"
 
     async def find_files(self, regex: str) -> str:
         """Search for files matching regex string in the name, searching recursively."""
-        files = []
-        compiled_regex = re.compile(regex)
-        # Use asyncio.to_thread to run the blocking os.walk in a separate thread
-        for root, _, filenames in await asyncio.to_thread(os.walk, self.path):
-            for filename in filenames:
-                if compiled_regex.search(filename):
-                    relative_path = os.path.relpath(
-                        os.path.join(root, filename), self.path
-                    )
-                    files.append(f"- {relative_path}")
-        if len(files) == 0:
-            return f"No file names containing {regex} found."
-        return "\n".join(files[:100])
+        search = await run_search(
+            self.path,
+            regex,
+            names=True,
+            timeout=self.search_timeout,
+            index_path=self.search_index_path,
+            extra_files=sorted(self._created_files),
+        )
+        if len(search.files) == 0:
+            return f"No file names containing {regex} found. {search.notes()}".strip()
+        viewed = self.viewed_files()
+        names = format_names(rank_files(search.files, viewed), viewed)
+        return "\n".join([names, search.notes()]).strip()
 
     @trace
     async def string_search(self, search_input: Search) -> str:
         try:
-            code_search = await self.code_search(search_input.regex)
-            file_search = await self.find_files(search_input.regex)
+            if search_input.cursor:
+                # All the file names are listed on the first page
+                code_search = await self.code_search(
+                    search_input.regex, search_input.cursor
+                )
+                return f"Files containing {search_input.regex}:\n\n{code_search}"
+            code_search, file_search = await asyncio.gather(
+                self.code_search(search_input.regex),
+                self.find_files(search_input.regex),
+            )
         except Exception as e:
             return f"Error searching for regex: {search_input.regex}. Error: {e}"
-        return f"First 100 files containing {search_input.regex}:\n\n{code_search}\n\nFirst 100 filenames matching {search_input.regex}:\n\n{file_search}"
+        return f"Files containing {search_input.regex}:\n\n{code_search}\n\nFile names matching {search_input.regex}:\n\n{file_search}"
+
+    @trace
+    async def explore(self, explore_input: Explore) -> str:
+        """Run the read only searches and views of the batch concurrently and combine their results."""
+        reads = [*explore_input.searches, *explore_input.views]
+        if not reads:
+            return "Nothing to explore: provide at least one search or file view."
+        results = await asyncio.gather(
+            *(self.string_search(search) for search in explore_input.searches),
+            *(
+                view_file(self.path, view, self._view_history, self.step)
+                for view in explore_input.views
+            ),
+            return_exceptions=True,
+        )
+        return "\n\n".join(
+            f"## {read}\n\n{f'Error: {result}' if isinstance(result, Exception) else result}"
+            for read, result in zip(reads, results)
+        )
+
+    @trace
+    async def repo_map(self, repo_map_input: RepoMap) -> str:
+        """Map the python modules of the repository, from the per commit cache when there is one."""
+        repo_map = await ensure_repo_map(self.path, self.repo_map_path)
+        return filter_repo_map(repo_map, repo_map_input.directory)
+
+    async def with_deadline(self, coroutine, description: str) -> str:
+        """Run a read only action, cancelling it if it takes longer than the action timeout."""
+        try:
+            return await asyncio.wait_for(coroutine, self.action_timeout)
+        except asyncio.TimeoutError:
+            return f"{description} did not finish within {self.action_timeout}s and was cancelled. Try a narrower action."
 
     async def execute_action(self, action: Action) -> str:
         """Execute the action returned by the agent."""
         if action.action_name == "search":
-            return await self.string_search(cast(Search, action.action_input))
+            search_input = cast(Search, action.action_input)
+            return await self.with_deadline(
+                self.string_search(search_input), str(search_input)
+            )
         elif action.action_name == "edits":
+            self._search_results.clear()
             return await self.edit_file(cast(Edits, action.action_input))
         elif action.action_name == "submit":
             return "Submitted the solution."
         elif action.action_name == "create_file":
+            self._search_results.clear()
             return await self.create_file(cast(CreateFile, action.action_input))
         elif action.action_name == "view_file":
             view_file_input = cast(ViewFile, action.action_input)
-            return await view_file(
-                self.path,
-                view_file_input,
+            return await self.with_deadline(
+                view_file(self.path, view_file_input, self._view_history, self.step),
+                str(view_file_input),
+            )
+        elif action.action_name == "explore":
+            explore_input = cast(Explore, action.action_input)
+            return await self.with_deadline(self.explore(explore_input), "Exploring")
+        elif action.action_name == "repo_map":
+            repo_map_input = cast(RepoMap, action.action_input)
+            return await self.with_deadline(
+                self.repo_map(repo_map_input), str(repo_map_input)
             )
         else:
             raise ValueError(f"Unknown action: {action.action_name}")
 
+    def prompt_tracker(self, function: str) -> PromptTracker:
+        if function not in self._prompt_trackers:
+            self._prompt_trackers[function] = PromptTracker(function)
+        return self._prompt_trackers[function]
+
     async def reset(self) -> None:
         """Reset the agent's state."""
         self.trajectory = Trajectory(actions=[])
+        self._view_history = ViewHistory()
+        self._search_results = OrderedDict()
+
+    async def resume(self) -> int:
+        """
+        Restore the trajectory, the evaluation counters and the workspace edits from the checkpoint.
+        Returns the step to continue from.
+        """
+        if not self.checkpoint_path:
+            return 0
+        checkpoints = load_checkpoints(self.checkpoint_path)
+        if not checkpoints:
+            return 0
+        self.trajectory = Trajectory(
+            actions=[checkpoint.action for checkpoint in checkpoints],
+            gained_knowledge=[
+                checkpoint.action.action.learning
+                for checkpoint in checkpoints
+                if checkpoint.action.action.learning
+            ],
+        )
+        self.evaluations_run = checkpoints[-1].evaluations_run
+        self.evaluations_skipped = checkpoints[-1].evaluations_skipped
+        diffs = [c.diff for c in checkpoints if c.diff is not None]
+        if diffs and diffs[-1]:
+            await apply_patch(self.path, diffs[-1])
+        self.log(f"Resumed from checkpoint at step {checkpoints[-1].step}")
+        return checkpoints[-1].step + 1
+
+    async def checkpoint(self, step: int, action_with_result: ActionWithResult) -> None:
+        """Append the step to the checkpoint, with the workspace diff if the step edited files."""
+        if not self.checkpoint_path:
+            return
+        diff = None
+        if action_with_result.action.action_name in ["edits", "create_file"]:
+            diff = await asyncio.to_thread(get_diff, self.path)
+        await asyncio.to_thread(
+            append_checkpoint,
+            self.checkpoint_path,
+            Checkpoint(
+                step=step,
+                action=action_with_result,
+                diff=diff,
+                evaluations_run=self.evaluations_run,
+                evaluations_skipped=self.evaluations_skipped,
+            ),
+        )
 
     async def go(self, max_steps=1) -> bool:
-        for i in range(max_steps):
+        start = await self.resume()
+        if self.trajectory.actions and (
+            self.trajectory.actions[-1].action.action_name == "submit"
+        ):
+            return True
+        for i in range(start, max_steps):
             with start_span(name="step", metadata={"step": i}):
-                action = await self.get_action(
-                    trajectory=self.trajectory,
+                timings = {}
+                started = time.monotonic()
+                # Keyword order is the JSON key order of the prompt, stable inputs first
+                action_inputs = dict(
                     problem=self.problem_statement,
                     other_info=self.other_info,
+                    trajectory=self.trajectory,
                 )
+                self.prompt_tracker("get_action").track(**action_inputs)
+                action = await router.call(self.get_action, **action_inputs)
+                timings["get_action"] = time.monotonic() - started
                 if action.learning:
                     self.trajectory.gained_knowledge.append(action.learning)
 
-                self.log("======================\n")
-                self.log(f"Thoughts: {action.thoughts}\n\n")
-                self.log(f"Action Name: {action.action_name}\n\n")
-                self.log(f"Action Input:\n{action.action_input}\n\n")
-
-                if self.evaluate:
-                    evaluation = await evaluate_action(
-                        trajectory=self.trajectory,
-                        action=action,
-                        possible_actions=Action.model_json_schema(),
+                if self.evaluate and not self.gate.should_evaluate(
+                    self.trajectory, action
+                ):
+                    self.evaluations_skipped += 1
+                    started = time.monotonic()
+                    result = await self.execute_action(action)
+                    timings["execute"] = time.monotonic() - started
+                elif self.evaluate:
+                    self.evaluations_run += 1
+                    started = time.monotonic()
+                    evaluation_inputs = dict(
                         problem=self.problem_statement,
+                        possible_actions=action_schema(),
+                        trajectory=self.trajectory,
+                        action_to_evaluate=action,
                     )
+                    self.prompt_tracker("evaluate_action").track(**evaluation_inputs)
+                    evaluation = await router.call(evaluate_action, **evaluation_inputs)
+                    timings["evaluate"] = time.monotonic() - started
                     if not evaluation.right_track:
                         result = "An evaluator thinks you're not on the right track:\n"
                         result += (
@@ -179,18 +349,40 @@ class Agent(BaseModel):
                         result += f"Evaluator feedback: {evaluation.feedback}\n\n"
                         result += "Action result:\n\n"
                     else:
+                        started = time.monotonic()
                         result = await self.execute_action(action)
+                        timings["execute"] = time.monotonic() - started
 
                 else:
+                    started = time.monotonic()
                     result = await self.execute_action(action)
+                    timings["execute"] = time.monotonic() - started
                 action_with_result = ActionWithResult(action=action, result=result)
                 self.trajectory.actions.append(action_with_result)
+                await self.checkpoint(i, action_with_result)
 
-                self.log(f"Result:\n{result}")
+                self.log_step(i, action, result, timings)
                 if action.action_name == "submit":
                     return True
         self.log("Failed to solve the problem in the given steps.")
         return False
 
+    def log_step(
+        self, step: int, action: Action, result: str, timings: dict[str, float]
+    ) -> None:
+        log_event(
+            "step",
+            0,
+            step=step,
+            workspace=self.path,
+            action=action.action_name,
+            thoughts=action.thoughts,
+            action_input=str(action.action_input),
+            result=result,
+            timings={name: round(seconds, 2) for name, seconds in timings.items()},
+        )
+        total = sum(timings.values())
+        progress(f"step {step}: {action.action_name} ({total:.1f}s)")
+
     def log(self, message: str) -> None:
-        print(f"[{self.instance_id}] {message}")
+        progress(message)
@@ -0,0 +1,50 @@
+import os
+from typing import Optional
+
+from pydantic import BaseModel, Field, ValidationError
+
+from .actions import ActionWithResult
+
+
+class Checkpoint(BaseModel):
+    """One step of an agent run, appended as a JSON line after the step completes."""
+
+    step: int
+    action: ActionWithResult
+    diff: Optional[str] = Field(
+        None,
+        description="The workspace diff after the step, only recorded for steps that changed files.",
+    )
+    evaluations_run: int = Field(
+        0, description="Actions sent to the evaluator up to and including this step."
+    )
+    evaluations_skipped: int = Field(
+        0, description="Actions the gate let through unevaluated up to this step."
+    )
+
+
+def append_checkpoint(path: str, checkpoint: Checkpoint) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as checkpoint_file:
+        checkpoint_file.write(checkpoint.model_dump_json() + "\n")
+
+
+def load_checkpoints(path: str) -> list[Checkpoint]:
+    """
+    Read back the steps of a previous run. A last line cut short by a crash is dropped from the file
+    so that new steps can be appended after the valid ones.
+    """
+    if not os.path.exists(path):
+        return []
+    checkpoints = []
+    valid_bytes = 0
+    with open(path, "rb") as checkpoint_file:
+        for line in checkpoint_file:
+            try:
+                checkpoints.append(Checkpoint.model_validate_json(line))
+            except ValidationError:
+                break
+            valid_bytes += len(line)
+    if valid_bytes != os.path.getsize(path):
+        os.truncate(path, valid_bytes)
+    return checkpoints
@@ -3,6 +3,8 @@ import os
 
 from delvin.agent.actions import Edit, Edits
 from delvin.agent.functions import smart_code_replace
+from delvin.log import log_event
+from delvin.routing import router
 
 
 async def edit_full_rewrite(root_path: str, edit: Edit) -> str:
@@ -25,24 +27,26 @@ async def edit_full_rewrite(root_path: str, edit: Edit) -> str:
     start_index = edit.start_line - 1
     end_index = edit.end_line
     padding_lines = 5
+    padding_start = max(0, start_index - padding_lines)
 
-    to_edit = "".join(lines[start_index - padding_lines : end_index + padding_lines])
+    to_edit = "".join(lines[padding_start : end_index + padding_lines])
 
-    new_lines = await smart_code_replace(to_edit, edit.code_to_replace, edit.new_code)
+    new_lines = await router.call(
+        smart_code_replace, to_edit, edit.code_to_replace, edit.new_code
+    )
 
-    print(
-        "CODE EDIT",
+    log_event(
+        "code_edit",
+        2,
+        file_path=edit.file_path,
+        to_edit=to_edit,
+        code_to_replace=edit.code_to_replace,
+        new_code=edit.new_code,
+        new_lines=new_lines,
     )
-    print("".join(to_edit))
-    print("To replace")
-    print(edit.code_to_replace)
-    print("New code")
-    print(edit.new_code)
-    print("New lines")
-    print("".join(new_lines))
 
     new_content = (
-        "".join(lines[: start_index - padding_lines])
+        "".join(lines[:padding_start])
         + new_lines
         + "".join(lines[end_index + padding_lines :])
     )
@@ -27,10 +27,10 @@ class Evaluation(BaseModel):
 
 @fn
 async def evaluate_action(
+    problem: str,
+    possible_actions: str,
     trajectory: Trajectory,
     action_to_evaluate: Action,
-    possible_actions: str,
-    problem: str,
 ) -> Evaluation:
     """
     Evaluate the action an agent is going to take given its trajectory and the actions it can take.
@@ -0,0 +1,50 @@
+from pydantic import BaseModel, Field
+
+from .actions import Action, Trajectory
+
+
+class EvaluationGate(BaseModel):
+    """Decides locally whether an action goes through the evaluator. The base gate evaluates every action."""
+
+    name: str = "always"
+
+    def should_evaluate(self, trajectory: Trajectory, action: Action) -> bool:
+        return True
+
+
+class SelectiveGate(EvaluationGate):
+    """
+    Only evaluates the actions that change the repository or end the run, actions repeating an earlier
+    one, and any action once the agent went too many steps without a successful edit.
+    """
+
+    name: str = "selective"
+    actions: list[str] = Field(default_factory=lambda: ["edits", "submit"])
+    evaluate_repeats: bool = True
+    stall_steps: int = 8
+
+    def should_evaluate(self, trajectory: Trajectory, action: Action) -> bool:
+        if action.action_name in self.actions:
+            return True
+        if self.evaluate_repeats and any(
+            previous.action.action_name == action.action_name
+            and previous.action.action_input == action.action_input
+            for previous in trajectory.actions
+        ):
+            return True
+        return steps_without_progress(trajectory) >= self.stall_steps
+
+
+def steps_without_progress(trajectory: Trajectory) -> int:
+    """Number of steps since the last successful edit."""
+    steps = 0
+    for previous in reversed(trajectory.actions):
+        if previous.action.action_name == "edits" and previous.result.startswith(
+            "Edits applied successfully"
+        ):
+            break
+        steps += 1
+    return steps
+
+
+GATES = {"always": EvaluationGate, "selective": SelectiveGate}
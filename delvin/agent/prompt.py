@@ -0,0 +1,80 @@
+"""
+Inputs of the @fn functions are sent as one JSON message whose keys follow the order of the arguments
+in the call, not of the function parameters: keyword arguments keep the order they are passed in.
+Callers pass the stable inputs (problem, hints, schema) first and the append only trajectory last, so
+that every call shares a byte identical prefix with the previous one and provider side prompt caching
+can kick in.
+"""
+
+import functools
+import json
+
+from pydantic import BaseModel
+
+from delvin.log import log_event
+
+from .actions import Action, Trajectory
+
+
+@functools.lru_cache(maxsize=None)
+def action_schema() -> dict:
+    """The Action JSON schema, computed once."""
+    return Action.model_json_schema()
+
+
+def common_prefix_length(a: str, b: str, block: int = 4096) -> int:
+    length = 0
+    limit = min(len(a), len(b))
+    while (
+        length + block <= limit
+        and a[length : length + block] == b[length : length + block]
+    ):
+        length += block
+    while length < limit and a[length] == b[length]:
+        length += 1
+    return length
+
+
+class PromptTracker:
+    """
+    Serializes the inputs of one function exactly like the opperai SDK does, reusing the JSON of the
+    trajectory steps already seen, and reports how much of each call is a prefix of the previous one.
+    """
+
+    def __init__(self, function: str):
+        self.function = function
+        self.steps: list[str] = []
+        self.previous = ""
+
+    def serialize_trajectory(self, trajectory: Trajectory) -> str:
+        if len(trajectory.actions) < len(self.steps):
+            self.steps = []
+        for action in trajectory.actions[len(self.steps) :]:
+            self.steps.append(json.dumps(action.model_dump()))
+        actions = "[" + ", ".join(self.steps) + "]"
+        knowledge = json.dumps(trajectory.gained_knowledge)
+        return f'{{"actions": {actions}, "gained_knowledge": {knowledge}}}'
+
+    def serialize(self, **inputs) -> str:
+        parts = []
+        for key, value in inputs.items():
+            if isinstance(value, Trajectory):
+                fragment = self.serialize_trajectory(value)
+            elif isinstance(value, BaseModel):
+                fragment = json.dumps(value.model_dump())
+            else:
+                fragment = json.dumps(value)
+            parts.append(f"{json.dumps(key)}: {fragment}")
+        return "{" + ", ".join(parts) + "}"
+
+    def track(self, **inputs) -> None:
+        """Log the length of the call input and of the prefix it shares with the previous call."""
+        serialized = self.serialize(**inputs)
+        prefix = common_prefix_length(self.previous, serialized)
+        self.previous = serialized
+        log_event(
+            "prompt",
+            function=self.function,
+            prefix_chars=prefix,
+            total_chars=len(serialized),
+        )
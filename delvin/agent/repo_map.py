@@ -0,0 +1,140 @@
+import ast
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Optional
+
+from delvin.github import is_clean
+
+from .search import MAX_FILE_BYTES, walk_files
+
+MAX_MAP_CHARS = 20000
+MAP_WORKERS = min(4, os.cpu_count() or 1)
+REPO_MAP_HEADER = (
+    "Repository map: the top level classes and functions of every python module.\n"
+)
+
+repo_map_locks: dict[str, asyncio.Lock] = {}
+executor: Optional[ProcessPoolExecutor] = None
+
+
+def outline_module(file_path: str) -> list[str]:
+    """Top level classes and functions of a python module, empty if it cannot be parsed."""
+    try:
+        if os.path.getsize(file_path) > MAX_FILE_BYTES:
+            return []
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as file:
+            tree = ast.parse(file.read())
+    except (OSError, SyntaxError, ValueError):
+        return []
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            names.append(f"class {node.name}")
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            names.append(f"def {node.name}")
+    return names
+
+
+def outline_modules(file_paths: list[str]) -> list[list[str]]:
+    return [outline_module(file_path) for file_path in file_paths]
+
+
+def repo_map_executor() -> ProcessPoolExecutor:
+    """
+    One bounded pool shared by every repo map build, so that concurrent builds cannot multiply the workers.
+    Workers are spawned rather than forked, the event loop process runs other threads.
+    """
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor(
+            max_workers=MAP_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return executor
+
+
+def build_repo_map(root_path: str, pool: Optional[Executor] = None) -> str:
+    """
+    Parse every python module of the repository and return one line per module.
+    With a pool the modules are parsed by its workers, otherwise in the calling process.
+    """
+    file_paths = [path for path in walk_files(root_path) if path.endswith(".py")]
+    if pool is None:
+        outlines = outline_modules(file_paths)
+    else:
+        chunk_size = max(1, len(file_paths) // (MAP_WORKERS * 4) + 1)
+        chunks = [
+            file_paths[i : i + chunk_size]
+            for i in range(0, len(file_paths), chunk_size)
+        ]
+        outlines = [
+            outline for chunk in pool.map(outline_modules, chunks) for outline in chunk
+        ]
+    lines = [
+        f"{os.path.relpath(file_path, root_path)}: {', '.join(names)}".rstrip(": ")
+        for file_path, names in zip(file_paths, outlines)
+    ]
+    return "\n".join(lines)
+
+
+async def ensure_repo_map(root_path: str, cache_path: Optional[str] = None) -> str:
+    """
+    Return the repo map of the workspace at root_path. With a cache_path, the map is built once per
+    (repo, base commit) and shared by every workspace checked out at that commit. Only a clean workspace
+    can fill the cache, a workspace with edits gets a map of its own.
+    """
+    if cache_path is not None and not os.path.exists(cache_path):
+        if not await is_clean(root_path):
+            cache_path = None
+    if cache_path is None:
+        return await asyncio.to_thread(build_repo_map, root_path, repo_map_executor())
+    lock = repo_map_locks.setdefault(cache_path, asyncio.Lock())
+    async with lock:
+        if not os.path.exists(cache_path):
+            repo_map = await asyncio.to_thread(
+                build_repo_map, root_path, repo_map_executor()
+            )
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(f"{cache_path}.tmp", "w") as cache_file:
+                cache_file.write(repo_map)
+            os.replace(f"{cache_path}.tmp", cache_path)
+            return repo_map
+    with open(cache_path, "r") as cache_file:
+        return cache_file.read()
+
+
+def filter_repo_map(
+    repo_map: str, directory: str, max_chars: int = MAX_MAP_CHARS
+) -> str:
+    """Keep the modules under the directory, cut at max_chars."""
+    prefix = directory.strip("/")
+    lines = [
+        line
+        for line in repo_map.splitlines()
+        if not prefix or line.split(":")[0] == prefix or line.startswith(f"{prefix}/")
+    ]
+    if not lines:
+        return f"No python modules found under '{directory}'."
+    result = ""
+    for index, line in enumerate(lines):
+        if len(result) + len(line) > max_chars:
+            result += f"... {len(lines) - index} more modules, map a subdirectory to see them."
+            break
+        result += f"{line}\n"
+    return REPO_MAP_HEADER + result
+
+
+def trim_repo_map(repo_map: str, max_chars: int = 4000) -> str:
+    """Keep the shallowest modules that fit in max_chars, to give an overview of the repository."""
+    lines = sorted(
+        repo_map.splitlines(), key=lambda line: line.split(":")[0].count("/")
+    )
+    kept = []
+    size = 0
+    for line in lines:
+        if size + len(line) > max_chars:
+            break
+        kept.append(line)
+        size += len(line) + 1
+    return REPO_MAP_HEADER + "\n".join(sorted(kept))
@@ -0,0 +1,377 @@
+"""
+Regex search over a repository, run in a separate process so that a pathological regex or a huge file
+can be killed once the search runs over its deadline instead of stalling the event loop.
+Matches are grouped per file and ranked so that one noisy file cannot crowd out the rest.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+from typing import Iterator, Optional, Sequence
+
+MAX_FILES = 2000
+MAX_FILE_BYTES = 1_000_000
+MAX_TOTAL_BYTES = 100_000_000
+MAX_LINES_PER_FILE = 20
+SEARCH_TIMEOUT = 20.0
+FILES_PER_PAGE = 15
+MAX_NAME_MATCHES = 100
+LINES_SHOWN_PER_FILE = 3
+
+DEFINITION = re.compile(r"^\s*(?:async\s+def|def|class)\s")
+TEST_DIRECTORIES = {"test", "tests", "testing"}
+DOC_DIRECTORIES = {"doc", "docs"}
+DOC_EXTENSIONS = {".rst", ".md", ".txt"}
+VENDORED_DIRECTORIES = {
+    "vendor",
+    "vendored",
+    "_vendor",
+    "third_party",
+    "thirdparty",
+    "externals",
+    "node_modules",
+    "site-packages",
+}
+CATEGORIES = ["source", "tests", "docs", "vendored"]
+
+
+class FileMatches:
+    """Matches of a search in one file. Only the first lines are kept, definitions first."""
+
+    def __init__(
+        self,
+        path: str,
+        count: int = 0,
+        lines: Optional[list[tuple[int, str]]] = None,
+        definitions: int = 0,
+    ):
+        self.path = path
+        self.count = count
+        self.lines = lines or []
+        self.definitions = definitions
+
+
+class SearchResult:
+    """Files matched by a search, with the reason it stopped early if it did."""
+
+    def __init__(
+        self,
+        files: list[FileMatches],
+        skipped_files: int = 0,
+        partial: Optional[str] = None,
+    ):
+        self.files = files
+        self.skipped_files = skipped_files
+        self.partial = partial
+
+    @property
+    def match_count(self) -> int:
+        return sum(file.count for file in self.files)
+
+    def notes(self) -> str:
+        notes = []
+        if self.partial:
+            notes.append(f"Partial results: {self.partial}.")
+        if self.skipped_files:
+            notes.append(f"Skipped {self.skipped_files} binary or oversized files.")
+        return " ".join(notes)
+
+
+def is_binary(file_path: str) -> bool:
+    with open(file_path, "rb") as file:
+        return b"\0" in file.read(8192)
+
+
+def walk_files(root_path: str) -> Iterator[str]:
+    """Yield all files under root_path, skipping directories starting with '.'."""
+    for root, dirnames, filenames in os.walk(root_path):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for filename in sorted(filenames):
+            yield os.path.join(root, filename)
+
+
+def build_search_index(root_path: str) -> dict:
+    """
+    The files a content search reads, and the binary or oversized ones it skips, relative to root_path.
+    A search given the index of its base commit skips the directory walk and the binary checks.
+    """
+    files, skipped = [], []
+    for file_path in walk_files(root_path):
+        try:
+            readable = os.path.getsize(file_path) <= MAX_FILE_BYTES and not is_binary(
+                file_path
+            )
+        except OSError:
+            continue
+        (files if readable else skipped).append(os.path.relpath(file_path, root_path))
+    return {"files": files, "skipped": skipped}
+
+
+def load_search_index(index_path: Optional[str]) -> Optional[dict]:
+    if not index_path:
+        return None
+    try:
+        with open(index_path, "r") as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return None
+
+
+def unindexed(index: dict, extra_files: Sequence[str]) -> list[str]:
+    """The extra files that are not already in the index."""
+    indexed = {*index["files"], *index["skipped"]}
+    return [path for path in extra_files if os.path.normpath(path) not in indexed]
+
+
+def search_names(
+    root_path: str,
+    regex: str,
+    index: Optional[dict] = None,
+    extra_files: Sequence[str] = (),
+) -> Iterator[dict]:
+    compiled_regex = re.compile(regex)
+    if index is None:
+        file_paths = walk_files(root_path)
+    else:
+        relative_paths = [
+            *index["files"],
+            *index["skipped"],
+            *unindexed(index, extra_files),
+        ]
+        file_paths = (os.path.join(root_path, path) for path in relative_paths)
+    for file_path in file_paths:
+        if compiled_regex.search(os.path.basename(file_path)):
+            yield {"file": os.path.relpath(file_path, root_path)}
+
+
+def search_file(root_path: str, file_path: str, compiled_regex) -> Optional[dict]:
+    """The match count and first matching lines of one file, definitions first."""
+    count = 0
+    definitions = []
+    usages = []
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as file:
+        for line_number, line in enumerate(file, start=1):
+            if compiled_regex.search(line):
+                count += 1
+                kept = definitions if DEFINITION.match(line) else usages
+                if len(kept) < MAX_LINES_PER_FILE:
+                    kept.append((line_number, line.strip()[0:120]))
+    if not count:
+        return None
+    return {
+        "file": os.path.relpath(file_path, root_path),
+        "count": count,
+        "lines": (definitions + usages)[:MAX_LINES_PER_FILE],
+        "definitions": len(definitions),
+    }
+
+
+def search_contents(
+    root_path: str,
+    regex: str,
+    index: Optional[dict] = None,
+    extra_files: Sequence[str] = (),
+) -> Iterator[dict]:
+    compiled_regex = re.compile(regex)
+    if index is None:
+        candidates = ((file_path, False) for file_path in walk_files(root_path))
+    else:
+        for path in index["skipped"]:
+            yield {"skipped": path}
+        candidates = [
+            *((os.path.join(root_path, path), True) for path in index["files"]),
+            *(
+                (os.path.join(root_path, path), False)
+                for path in unindexed(index, extra_files)
+            ),
+        ]
+    total_bytes = 0
+    for file_path, readable in candidates:
+        try:
+            size = os.path.getsize(file_path)
+            if not readable and (size > MAX_FILE_BYTES or is_binary(file_path)):
+                yield {"skipped": file_path}
+                continue
+            total_bytes += size
+            if total_bytes > MAX_TOTAL_BYTES:
+                yield {"partial": f"read budget of {MAX_TOTAL_BYTES} bytes spent"}
+                return
+            matches = search_file(root_path, file_path, compiled_regex)
+            if matches:
+                yield matches
+        except OSError:
+            continue  # If there's an error opening/reading a file, skip it
+
+
+async def run_search(
+    root_path: str,
+    regex: str,
+    names: bool = False,
+    timeout: float = SEARCH_TIMEOUT,
+    max_files: int = MAX_FILES,
+    index_path: Optional[str] = None,
+    extra_files: Sequence[str] = (),
+) -> SearchResult:
+    """
+    Search file contents (or file names) under root_path for the regex in a worker process.
+    The worker is killed when the timeout is hit or the search gets cancelled, and the files found so far are returned.
+    With the search index of the base commit, only the indexed files and the extra files created since are read.
+    """
+    re.compile(regex)  # Surface invalid regexes before spawning the worker
+    command = [sys.executable, os.path.abspath(__file__)]
+    if names:
+        command.append("--names")
+    if index_path and os.path.exists(index_path):
+        command += ["--index", index_path, "--extra", *extra_files]
+    # Regexes starting with "-" must not be parsed as options
+    command += ["--", root_path, regex]
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    result = SearchResult(files=[])
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            if len(result.files) >= max_files:
+                result.partial = f"stopped after {max_files} matching files"
+                break
+            try:
+                line = await asyncio.wait_for(
+                    process.stdout.readline(), max(0, deadline - loop.time())
+                )
+            except asyncio.TimeoutError:
+                result.partial = f"search timed out after {timeout}s"
+                break
+            if not line:
+                break
+            event = json.loads(line)
+            if "file" in event:
+                result.files.append(
+                    FileMatches(
+                        event["file"],
+                        event.get("count", 0),
+                        [tuple(line) for line in event.get("lines", [])],
+                        event.get("definitions", 0),
+                    )
+                )
+            elif "skipped" in event:
+                result.skipped_files += 1
+            elif "partial" in event:
+                result.partial = event["partial"]
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+    return result
+
+
+def file_category(path: str) -> int:
+    """Index in CATEGORIES of the kind of file: source, tests, docs or vendored code."""
+    *directories, name = path.split(os.sep)
+    if VENDORED_DIRECTORIES.intersection(directories):
+        return 3
+    if (
+        TEST_DIRECTORIES.intersection(directories)
+        or name.startswith("test_")
+        or name.endswith("_test.py")
+        or name == "conftest.py"
+    ):
+        return 1
+    if (
+        DOC_DIRECTORIES.intersection(directories)
+        or os.path.splitext(name)[1] in DOC_EXTENSIONS
+    ):
+        return 2
+    return 0
+
+
+def rank_files(
+    files: list[FileMatches], viewed: Optional[set[str]] = None
+) -> list[FileMatches]:
+    """Source before tests, docs and vendored code, then files defining a match, then files already viewed."""
+    viewed = viewed or set()
+    return sorted(
+        files,
+        key=lambda file: (
+            file_category(file.path),
+            file.definitions == 0,
+            file.path not in viewed,
+            file.path,
+        ),
+    )
+
+
+def format_file(file: FileMatches, viewed: set[str], show_lines: bool) -> list[str]:
+    tags = []
+    if show_lines:
+        tags.append(f"{file.count} match{'es' if file.count > 1 else ''}")
+    category = file_category(file.path)
+    if category:
+        tags.append(CATEGORIES[category])
+    if file.path in viewed:
+        tags.append("viewed")
+    formatted = [f"- {file.path} ({', '.join(tags)})" if tags else f"- {file.path}"]
+    if show_lines:
+        for line_number, line in file.lines[:LINES_SHOWN_PER_FILE]:
+            formatted.append(f"    line {line_number} : {line}")
+        hidden = file.count - min(len(file.lines), LINES_SHOWN_PER_FILE)
+        if hidden > 0:
+            formatted.append(f"    ... {hidden} more in this file")
+    return formatted
+
+
+def format_files(
+    ranked: list[FileMatches], viewed: Optional[set[str]] = None, cursor: int = 0
+) -> str:
+    """One page of ranked files, with their first matching lines and the cursor of the next page."""
+    viewed = viewed or set()
+    page = ranked[cursor : cursor + FILES_PER_PAGE]
+    if not page:
+        return f"No more files: there are {len(ranked)} in total."
+    formatted = [line for file in page for line in format_file(file, viewed, True)]
+    end = cursor + len(page)
+    if end < len(ranked):
+        formatted.append(
+            f"{len(ranked) - end} more files: search again with cursor={end} to see them."
+        )
+    return "\n".join(formatted)
+
+
+def format_names(ranked: list[FileMatches], viewed: Optional[set[str]] = None) -> str:
+    """The ranked files matched by name, up to MAX_NAME_MATCHES of them."""
+    viewed = viewed or set()
+    formatted = [
+        line
+        for file in ranked[:MAX_NAME_MATCHES]
+        for line in format_file(file, viewed, False)
+    ]
+    if len(ranked) > MAX_NAME_MATCHES:
+        formatted.append(
+            f"{len(ranked) - MAX_NAME_MATCHES} more file names, use a more specific regex to see them."
+        )
+    return "\n".join(formatted)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search a repository for a regex.")
+    parser.add_argument("root_path", type=str)
+    parser.add_argument("regex", type=str)
+    parser.add_argument("--names", action="store_true")
+    parser.add_argument("--index", type=str, default=None)
+    parser.add_argument("--extra", type=str, nargs="*", default=[])
+    args = parser.parse_args()
+
+    search = search_names if args.names else search_contents
+    try:
+        for event in search(
+            args.root_path, args.regex, load_search_index(args.index), args.extra
+        ):
+            print(json.dumps(event), flush=True)
+    except BrokenPipeError:
+        pass
@@ -1,8 +1,18 @@
+import asyncio
+import difflib
 import os
+from typing import Iterable, Optional
+
+from delvin.log import log_event
 
 from .actions import (
     ViewFile,
 )
+from .search import is_binary
+
+MAX_VIEW_BYTES = 5_000_000
+MAX_LINE_LENGTH = 2000
+DELTA_CONTEXT_LINES = 2
 
 
 def view_file_outline(file_path: str) -> str:
@@ -23,11 +33,126 @@ def view_file_outline(file_path: str) -> str:
     return outline_str
 
 
-async def view_file(root_path: str, view_file_input: ViewFile) -> str:
-    """View a file in the repository."""
-    print("view_file_input", view_file_input)
+def truncate_line(line: str) -> str:
+    if len(line) <= MAX_LINE_LENGTH:
+        return line
+    return f"{line[:MAX_LINE_LENGTH]} ... [{len(line) - MAX_LINE_LENGTH} characters truncated]\n"
+
+
+class ViewHistory:
+    """
+    The lines of each file an agent has already seen, and the file content at the time.
+    Used to answer repeated views with only what changed since the last view.
+    """
+
+    def __init__(self):
+        # file path -> (file lines at the last view, index of each line seen -> step it was shown at)
+        self.files: dict[str, tuple[list[str], dict[int, int]]] = {}
+
+    def seen_now(
+        self, file_path: str, lines: list[str]
+    ) -> tuple[dict[int, int], set[int]]:
+        """
+        The lines seen before that are unchanged and still at the line number they were shown with.
+        Lines moved by an insertion or deletion above them count as unseen, since the agent knows them
+        by their old numbers. Also returns the indices of changed lines.
+        """
+        seen_lines, seen = self.files[file_path]
+        if seen_lines == lines:
+            return seen, set()
+        matcher = difflib.SequenceMatcher(None, seen_lines, lines, autojunk=False)
+        mapping = {}
+        changed = set()
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                mapping.update({i1 + k: j1 + k for k in range(i2 - i1)})
+            else:
+                # A deletion is reported on the line that now follows it
+                changed.update(range(j1, max(j2, j1 + 1)))
+        return {i: step for i, step in seen.items() if mapping.get(i) == i}, changed
+
+    def delta(
+        self, view_file_input: ViewFile, lines: list[str], start: int, end: int
+    ) -> Optional[tuple[str, set[int]]]:
+        """
+        A compact answer for a window the agent already saw, with the indices of the lines it shows,
+        or None if the agent needs the full view.
+        """
+        file_path = view_file_input.file_path
+        if file_path not in self.files:
+            return None
+        seen, changed = self.seen_now(file_path, lines)
+        window = range(start, end)
+        if any(i not in seen and i not in changed for i in window):
+            return None
+        steps = ", ".join(
+            str(step) for step in sorted({seen[i] for i in window if i in seen})
+        )
+        viewed = (
+            f"since you viewed them at step {steps}"
+            if steps
+            else "since you viewed them"
+        )
+        changed = sorted(i for i in window if i in changed)
+        if not changed:
+            return (
+                f"{file_path}: lines {start + 1}-{end} are unchanged {viewed}. Set full to true to see them again.",
+                set(),
+            )
+
+        shown = set()
+        for i in changed:
+            shown.update(
+                range(
+                    max(start, i - DELTA_CONTEXT_LINES),
+                    min(end, i + DELTA_CONTEXT_LINES + 1),
+                )
+            )
+        hunks = ""
+        previous = None
+        for i in sorted(shown):
+            if previous is not None and i != previous + 1:
+                hunks += "...\n"
+            hunks += f"{i + 1}| {truncate_line(lines[i])}"
+            previous = i
+        return (
+            f"{file_path}: Total Lines: {len(lines)}. Lines {start + 1}-{end} changed {viewed}. "
+            f"Only the changed lines are shown with {DELTA_CONTEXT_LINES} lines of context, the other lines of the window "
+            f"are unchanged and keep their line numbers. Set full to true to see the whole window again.\n\n{hunks}",
+            shown,
+        )
+
+    def record(
+        self, file_path: str, lines: list[str], shown: Iterable[int], step: int
+    ) -> None:
+        """Remember the content of the file, and the lines shown to the agent at the step."""
+        seen = {}
+        if file_path in self.files:
+            seen, _ = self.seen_now(file_path, lines)
+        self.files[file_path] = (lines, {**seen, **dict.fromkeys(shown, step)})
+
+
+async def view_file(
+    root_path: str,
+    view_file_input: ViewFile,
+    history: Optional[ViewHistory] = None,
+    step: int = 0,
+) -> str:
+    """View a file in the repository. With a view history, windows already seen are answered with a delta."""
+    log_event("view_file", 2, view_file_input=str(view_file_input))
+    return await asyncio.to_thread(read_view, root_path, view_file_input, history, step)
+
+
+def read_view(
+    root_path: str,
+    view_file_input: ViewFile,
+    history: Optional[ViewHistory] = None,
+    step: int = 0,
+) -> str:
     file_path = os.path.join(root_path, view_file_input.file_path)
     try:
+        if os.path.getsize(file_path) > MAX_VIEW_BYTES or is_binary(file_path):
+            return f"Cannot view {view_file_input.file_path}: the file is binary or larger than {MAX_VIEW_BYTES} bytes."
         outline = view_file_outline(file_path)
         with open(file_path, "r") as file:
             all_lines = file.readlines()
@@ -37,8 +162,19 @@ async def view_file(root_path: str, view_file_input: ViewFile) -> str:
             )
             if start > len(all_lines):
                 return f"Incorrect line number: {view_file_input.cursor_line}. The file has only {len(all_lines)} lines."
+            if history is not None:
+                delta = None
+                if not view_file_input.full:
+                    delta = history.delta(view_file_input, all_lines, start, end)
+                if delta is not None:
+                    answer, shown = delta
+                    history.record(view_file_input.file_path, all_lines, shown, step)
+                    return answer
+                history.record(
+                    view_file_input.file_path, all_lines, range(start, end), step
+                )
             file_contents = "".join(
-                f"{index + start + 1}| {line}"
+                f"{index + start + 1}| {truncate_line(line)}"
                 for index, line in enumerate(all_lines[start:end])
             )
         return f"{view_file_input.file_path}:\n\n{outline}\n\n# File content:\n{file_contents}"
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+from pydantic import BaseModel
+
+from delvin.agent.agent import Agent
+from delvin.agent.edit import lint_file
+from delvin.github import get_changed_files, get_diff
+from delvin.log import progress
+
+
+class Attempt(BaseModel):
+    """The outcome of one agent attempt at an instance."""
+
+    index: int
+    agent: Agent
+    submitted: bool = False
+    diff: str = ""
+    lint_clean: bool = False
+
+
+async def is_lint_clean(workspace: str) -> bool:
+    """Check that every python file changed in the workspace passes the linter."""
+    for changed_file in get_changed_files(workspace):
+        if not changed_file.endswith(".py"):
+            continue
+        try:
+            await lint_file(os.path.join(workspace, changed_file))
+        except ValueError:
+            return False
+    return True
+
+
+async def run_attempt(index: int, agent: Agent, max_steps: int) -> Attempt:
+    submitted = await agent.go(max_steps=max_steps)
+    attempt = Attempt(index=index, agent=agent, submitted=submitted)
+    if submitted:
+        attempt.diff = get_diff(agent.path)
+        if attempt.diff:
+            attempt.lint_clean = await is_lint_clean(agent.path)
+    return attempt
+
+
+async def run_attempts(
+    agents: list[Agent],
+    max_steps: int = 30,
+    early_stop: bool = True,
+    budget: Optional[float] = None,
+) -> list[Attempt]:
+    """
+    Run one attempt per agent concurrently, each agent working in its own workspace.
+    With early_stop, the remaining attempts are cancelled as soon as one of them submits a lint clean diff.
+    The budget is a wall time limit in seconds after which unfinished attempts are cancelled.
+    Returns the attempts that finished, in completion order.
+    """
+    indexes = {
+        asyncio.create_task(run_attempt(index, agent, max_steps)): index
+        for index, agent in enumerate(agents)
+    }
+    pending = set(indexes)
+    deadline = None if budget is None else time.monotonic() + budget
+    finished = []
+    errors = []
+    try:
+        while pending:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                progress(
+                    f"Attempt budget of {budget}s spent, cancelling {len(pending)}"
+                )
+                break
+            for task in done:
+                error = task.exception()
+                if error is not None:
+                    errors.append(error)
+                    progress(
+                        f"Attempt {indexes[task]} failed: {error!r}",
+                        attempt=indexes[task],
+                        error=repr(error),
+                    )
+                    continue
+                finished.append(task.result())
+            if early_stop and any(a.diff and a.lint_clean for a in finished):
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    if not finished and errors:
+        raise errors[0]
+    return finished
+
+
+def rank_attempts(attempts: list[Attempt]) -> list[Attempt]:
+    """Rank attempts best first: submitted diffs, lint clean, then the smallest diff."""
+    return sorted(
+        attempts,
+        key=lambda a: (not a.diff, not a.lint_clean, len(a.diff.splitlines()), a.index),
+    )
@@ -0,0 +1,52 @@
+from typing import Optional
+
+from delvin import Entry
+
+
+def get_entry(raw: dict) -> Entry:
+    return Entry(
+        repo=raw["repo"],
+        base_commit=raw["base_commit"],
+        problem_statement=raw["problem_statement"],
+        hints_text=raw["hints_text"],
+        instance_id=raw["instance_id"],
+        test_patch=raw["test_patch"],
+        patch=raw["patch"],
+    )
+
+
+def load_entries(
+    dataset_name: str,
+    split: str = "dev",
+    instance_ids: Optional[list[str]] = None,
+    repos: Optional[list[str]] = None,
+    start: int = 0,
+    end: Optional[int] = None,
+) -> list[Entry]:
+    """
+    Stream the rows of a single split and keep the ones selected by instance id, repo and index range.
+    Only the requested split is read, and streaming stops as soon as the selection is complete.
+    """
+    # datasets is slow to import, only pay for it when entries are actually loaded
+    from datasets import load_dataset
+
+    dataset = load_dataset(dataset_name, split=split, streaming=True)
+    remaining = set(instance_ids) if instance_ids else None
+    entries = []
+    for index, raw in enumerate(dataset):
+        if end is not None and index >= end:
+            break
+        if index < start:
+            continue
+        if repos and raw["repo"] not in repos:
+            continue
+        if remaining is not None:
+            if raw["instance_id"] not in remaining:
+                continue
+            remaining.discard(raw["instance_id"])
+        entries.append(get_entry(raw))
+        if remaining is not None and not remaining:
+            break
+    if remaining:
+        print(f"Instances not found in {dataset_name}/{split}: {sorted(remaining)}")
+    return entries
@@ -1,122 +1,219 @@
 import os
-from typing import Tuple
+from typing import Optional, Tuple
 
 from opperai import AsyncClient, start_span
 from opperai.types import SpanMetric
 
 from delvin import Entry
 from delvin.agent.agent import Agent
-from delvin.github import clone_or_reset_repo, get_diff
+from delvin.agent.gating import EvaluationGate
+from delvin.agent.repo_map import ensure_repo_map, trim_repo_map
+from delvin.attempts import rank_attempts, run_attempts
+from delvin.github import remove_folder
+from delvin.log import instance_log, log_event, progress
 from delvin.predictions import (
     evaluate_fix,
     get_prediction,
     meta_evaluation,
     save_prediction,
 )
+from delvin.routing import router
+from delvin.workspaces import WorkspaceManager
 
 
 async def setup_agent(
-    entry: Entry, predictions_directory: str, working_dir=str, overwrite: bool = False
+    entry: Entry,
+    predictions_directory: str,
+    working_dir=str,
+    overwrite: bool = False,
+    gate: Optional[EvaluationGate] = None,
 ) -> Agent:
     prediction = get_prediction(entry.instance_id, predictions_directory)
     if prediction and not overwrite:
-        print(f"Prediction found for {entry.instance_id}. Skipping...")
+        progress("Prediction found. Skipping...")
         return None
     else:
-        print(f"Prediction not found for {entry.instance_id}. Fixing...")
+        progress("Prediction not found. Fixing...")
+
+    return create_agent(entry, working_dir, gate)
+
 
-    agent = Agent(
+def create_agent(
+    entry: Entry, working_dir: str, gate: Optional[EvaluationGate] = None
+) -> Agent:
+    return Agent(
         path=working_dir,
         other_info=entry.hints_text,
         problem_statement=entry.problem_statement,
         evaluate=True,
+        gate=gate or EvaluationGate(),
         instance_id=entry.instance_id,
     )
-    return agent
 
 
 async def agent_fix(
     entry: Entry,
     root_path: str,
     overwrite: bool = False,
+    attempts: int = 1,
+    early_stop: bool = True,
+    budget: Optional[float] = None,
+    workspaces: Optional[WorkspaceManager] = None,
+    gate: Optional[EvaluationGate] = None,
+    inject_repo_map: bool = False,
 ) -> Tuple[str, Agent]:
-    destination = f"{root_path}/entries/{entry.instance_id}/0/{entry.repo}"
+    """
+    Run `attempts` agents concurrently on the entry, each in its own workspace handed out by the
+    workspace manager, and return the diff of the best ranked one.
+    Every agent checkpoints its steps and resumes from them if an earlier run was interrupted.
+    With inject_repo_map, a trimmed map of the repository is added to the information given to the agents.
+    """
+    workspaces = workspaces or WorkspaceManager(root_path)
+    destination = workspaces.workspace_path(entry)
     agent = await setup_agent(
-        entry, f"{root_path}/predictions", destination, overwrite=overwrite
+        entry,
+        f"{root_path}/predictions",
+        destination,
+        overwrite=overwrite,
+        gate=gate,
     )
     if agent is None:
         return (None, None)
 
-    await clone_or_reset_repo(entry.repo, entry.base_commit, destination)
-    success = await agent.go(max_steps=30)
-    if success:
-        diff = get_diff(agent.path)
-        return (diff, agent)
-    return ("", agent)
+    paths = await workspaces.acquire(entry, attempts)
+    agents = [agent] + [create_agent(entry, path, gate) for path in paths[1:]]
+    checkpoints_directory = f"{root_path}/checkpoints/{entry.instance_id}"
+    if overwrite:
+        await remove_folder(checkpoints_directory)
+    repo_map_path = workspaces.repo_map_path(entry.repo, entry.base_commit)
+    search_index_path = workspaces.search_index_path(entry.repo, entry.base_commit)
+    repo_overview = ""
+    if inject_repo_map:
+        repo_overview = trim_repo_map(await ensure_repo_map(paths[0], repo_map_path))
+    for attempt, attempt_agent in enumerate(agents):
+        attempt_agent.checkpoint_path = f"{checkpoints_directory}/{attempt}.jsonl"
+        attempt_agent.repo_map_path = repo_map_path
+        attempt_agent.search_index_path = search_index_path
+        if repo_overview:
+            attempt_agent.other_info += f"\n\n{repo_overview}"
+    try:
+        finished = await run_attempts(
+            agents, max_steps=30, early_stop=early_stop, budget=budget
+        )
+    finally:
+        workspaces.release(entry.instance_id)
+    ranked = rank_attempts(finished)
+    if not ranked:
+        return ("", agent)
+    best = ranked[0]
+    if attempts > 1:
+        progress(
+            f"{len(finished)}/{attempts} attempts finished, picked attempt {best.index}"
+        )
+    return (best.diff, best.agent)
 
 
 async def fix(
     entry: Entry,
     root_path: str,
     overwrite: bool = False,
+    attempts: int = 1,
+    early_stop: bool = True,
+    budget: Optional[float] = None,
+    workspaces: Optional[WorkspaceManager] = None,
+    gate: Optional[EvaluationGate] = None,
+    inject_repo_map: bool = False,
 ) -> str:
-    print("=============================================================")
-    print(
-        f"Fixing {entry.instance_id} on repo {entry.repo} at commit {entry.base_commit}"
-    )
-    client = AsyncClient()
-
-    with start_span(
-        "fix",
-        entry.problem_statement,
-        {
-            "instance_id": entry.instance_id,
-            "repo": entry.repo,
-            "commit": entry.base_commit,
-        },
-    ) as span:
-        diff, agent = await agent_fix(entry, root_path, overwrite=overwrite)
-        if diff is None:
-            return None
-        print(f"Saving diff:\n{diff}")
-        span.output = diff
-        solution_diff = diff
-        evaluation = await evaluate_fix(
-            entry.problem_statement, solution_diff, entry.patch, entry.test_patch
-        )
-        print(evaluation)
-        meta_eval = await meta_evaluation(
-            trajectory=agent.trajectory,
-            problem=entry.problem_statement,
-            gold_diff=entry.patch,
-        )
-        save_prediction(
-            path=f"{root_path}/predictions",
-            instance_id=entry.instance_id,
-            prediction=diff,
-            model_name="delvin",
-            evaluation=evaluation,
-            meta_evaluation=meta_eval,
-        )
-        solution_diff = diff
-        await client.spans.save_metric(
-            span.span_uuid,
-            SpanMetric(dimension="correct", score=1 if evaluation.correct else 0),
-        )
-        await client.spans.save_metric(
-            span.span_uuid,
-            SpanMetric(dimension="pass_tests", score=1 if evaluation.pass_tests else 0),
-        )
-        await client.spans.save_metric(
-            span.span_uuid,
-            SpanMetric(
-                dimension="eval_score",
-                score=float(evaluation.score) / 10,
-                comment=evaluation.observations,
-            ),
-        )
+    async with instance_log(
+        f"{root_path}/logs/{entry.instance_id}.jsonl", entry.instance_id
+    ):
+        progress(f"Fixing on repo {entry.repo} at commit {entry.base_commit}")
+        client = AsyncClient()
+
+        with start_span(
+            "fix",
+            entry.problem_statement,
+            {
+                "instance_id": entry.instance_id,
+                "repo": entry.repo,
+                "commit": entry.base_commit,
+            },
+        ) as span:
+            diff, agent = await agent_fix(
+                entry,
+                root_path,
+                overwrite=overwrite,
+                attempts=attempts,
+                early_stop=early_stop,
+                budget=budget,
+                workspaces=workspaces,
+                gate=gate,
+                inject_repo_map=inject_repo_map,
+            )
+            if diff is None:
+                return None
+            log_event("diff", 0, diff=diff)
+            span.output = diff
+            solution_diff = diff
+            evaluation = await router.call(
+                evaluate_fix,
+                entry.problem_statement,
+                solution_diff,
+                entry.patch,
+                entry.test_patch,
+            )
+            log_event("evaluation", 0, **evaluation.model_dump())
+            progress(
+                f"Saved diff of {len(diff.splitlines())} lines, correct={evaluation.correct} score={evaluation.score}"
+            )
+            meta_eval = await router.call(
+                meta_evaluation,
+                trajectory=agent.trajectory,
+                problem=entry.problem_statement,
+                gold_diff=entry.patch,
+            )
+            save_prediction(
+                path=f"{root_path}/predictions",
+                instance_id=entry.instance_id,
+                prediction=diff,
+                model_name="delvin",
+                evaluation=evaluation,
+                meta_evaluation=meta_eval,
+                gating={
+                    "gate": agent.gate.name,
+                    "evaluations_run": agent.evaluations_run,
+                    "evaluations_skipped": agent.evaluations_skipped,
+                },
+            )
+            solution_diff = diff
+            await client.spans.save_metric(
+                span.span_uuid,
+                SpanMetric(dimension="correct", score=1 if evaluation.correct else 0),
+            )
+            await client.spans.save_metric(
+                span.span_uuid,
+                SpanMetric(
+                    dimension="pass_tests", score=1 if evaluation.pass_tests else 0
+                ),
+            )
+            await client.spans.save_metric(
+                span.span_uuid,
+                SpanMetric(
+                    dimension="eval_score",
+                    score=float(evaluation.score) / 10,
+                    comment=evaluation.observations,
+                ),
+            )
+            await client.spans.save_metric(
+                span.span_uuid,
+                SpanMetric(
+                    dimension="evaluations_skipped",
+                    score=agent.evaluations_skipped,
+                    comment=f"gate={agent.gate.name}, evaluations_run={agent.evaluations_run}",
+                ),
+            )
 
-    return solution_diff
+        return solution_diff
 
 
 def init_predictions_folder(path: str) -> None:
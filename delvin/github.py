@@ -2,13 +2,7 @@ import asyncio
 import os
 import subprocess
 
-
-async def clone_or_reset_repo(
-    repo_url: str, commit_hash: str, destination: str
-) -> None:
-    await clone_repo_at_commit(repo_url, commit_hash, destination)
-
-    print("Successfully reset the repository to the latest commit.")
+from delvin.log import log_event, progress
 
 
 async def clone_repo(repo_url: str, destination_folder: str, erase=False) -> None:
@@ -25,7 +19,7 @@ async def clone_repo(repo_url: str, destination_folder: str, erase=False) -> Non
     None
     """
     if erase and os.path.exists(destination_folder):
-        await asyncio.create_subprocess_shell(f"rm -rf {destination_folder}")
+        await remove_folder(destination_folder)
 
     if not os.path.exists(destination_folder):
         os.makedirs(destination_folder)
@@ -40,52 +34,143 @@ async def clone_repo(repo_url: str, destination_folder: str, erase=False) -> Non
     stdout, stderr = await process.communicate()
 
     if process.returncode == 0 and not erase:
-        print(
-            f"Destination folder {destination_folder} already exists and is a valid git repository. Not cloning."
-        )
+        log_event("clone_skipped", destination=destination_folder)
     else:
-        print(f"Cloning repository into {destination_folder}. Command: {clone_cmd}")
+        progress(f"Cloning {repo_url} into {destination_folder}")
         process = await asyncio.create_subprocess_shell(clone_cmd)
         await (
             process.communicate()
         )  # This line ensures the script waits for the clone to complete
 
 
-async def clone_repo_at_commit(
-    repo_url: str, commit_hash: str, destination_folder: str
+async def remove_folder(folder: str) -> None:
+    """Removes a folder and everything in it, waiting for the removal to complete."""
+    process = await asyncio.create_subprocess_exec(
+        "rm",
+        "-rf",
+        folder,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise ValueError(
+            f"Error removing {folder}: {stderr.decode().strip()} {stdout.decode().strip()}"
+        )
+
+
+async def ensure_commit(repo_folder: str, commit_hash: str) -> None:
+    """Fetches from the remote if the commit is not already in a local clone."""
+    process = await asyncio.create_subprocess_shell(
+        f"git -C {repo_folder} cat-file -e {commit_hash}^{{commit}}",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    await process.communicate()
+    if process.returncode == 0:
+        return
+    process = await asyncio.create_subprocess_shell(
+        f"git -C {repo_folder} fetch --quiet origin",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    await process.communicate()
+
+
+async def clone_local_workspace(
+    source_folder: str, commit_hash: str, destination_folder: str
 ) -> None:
     """
-    Clones a GitHub repository at a specific commit hash into a given folder.
+    Creates a cheap extra workspace from an already cloned repository. The clone shares the object
+    store of the source (git clone --shared) so nothing is fetched from GitHub or copied on disk
+    except the checked out files. An existing workspace is cleaned and reset instead.
 
     Parameters:
-    - repo_url (str): The URL of the GitHub repository to clone.
-    - commit_hash (str): The specific commit hash to checkout after cloning.
-    - destination_folder (str): The local folder where the repository should be cloned.
+    - source_folder (str): A local clone of the repository.
+    - commit_hash (str): The specific commit hash to checkout.
+    - destination_folder (str): The local folder for the new workspace.
 
     Returns:
     None
     """
-    try:
-        await clone_repo(repo_url, destination_folder)
-
-        # Clean it all
+    check_git_cmd = f"git -C {destination_folder} rev-parse"
+    process = await asyncio.create_subprocess_shell(
+        check_git_cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    await process.communicate()
 
-        subprocess.run(
-            ["git", "-C", destination_folder, "checkout", "--", "."], check=True
+    if process.returncode == 0:
+        commands = [
+            f"git -C {destination_folder} checkout -- .",
+            f"git -C {destination_folder} clean -fdx",
+        ]
+    else:
+        os.makedirs(os.path.dirname(destination_folder), exist_ok=True)
+        commands = [
+            f"git clone --quiet --shared --no-checkout {source_folder} {destination_folder}"
+        ]
+    commands.append(f"git -C {destination_folder} checkout --quiet {commit_hash}")
+
+    for command in commands:
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
         )
-        subprocess.run(["git", "-C", destination_folder, "clean", "-fdx"], check=True)
-    except Exception as e:
-        print(f"Error cloning repository: {e}\n\nWill try to reset the repository.")
-        await clone_repo(repo_url, destination_folder, erase=True)
-    # Checkout the specific commit
-    checkout_cmd = f"git -C {destination_folder} checkout {commit_hash}"
-    await asyncio.create_subprocess_shell(checkout_cmd)
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise ValueError(
+                f"Error preparing workspace {destination_folder}: {stderr.decode().strip()} {stdout.decode().strip()}"
+            )
+
+
+async def apply_patch(destination_folder: str, patch: str) -> None:
+    """Applies a diff, as returned by get_diff, to the given repository."""
+    process = await asyncio.create_subprocess_exec(
+        "git",
+        "-C",
+        destination_folder,
+        "apply",
+        "-",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate(patch.encode("utf-8"))
+    if process.returncode != 0:
+        raise ValueError(
+            f"Error applying patch: {stderr.decode().strip()} {stdout.decode().strip()}"
+        )
+
+
+async def is_clean(destination_folder: str) -> bool:
+    """Whether the repository has no modified or untracked files."""
+    process = await asyncio.create_subprocess_exec(
+        "git",
+        "-C",
+        destination_folder,
+        "status",
+        "--porcelain",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, _ = await process.communicate()
+    return process.returncode == 0 and not stdout.strip()
 
 
 def get_diff(destination_folder: str) -> str:
     """Returns the output of git diff for the given repository."""
 
-    os.chdir(destination_folder)
-    diff_cmd = "git diff"
-    diff_output = subprocess.run(diff_cmd, check=True, shell=True, capture_output=True)
+    diff_cmd = ["git", "-C", destination_folder, "diff"]
+    diff_output = subprocess.run(diff_cmd, check=True, capture_output=True)
     return diff_output.stdout.decode("utf-8")
+
+
+def get_changed_files(destination_folder: str) -> list[str]:
+    """Returns the paths of the files modified in the given repository, relative to its root."""
+
+    diff_cmd = ["git", "-C", destination_folder, "diff", "--name-only"]
+    diff_output = subprocess.run(diff_cmd, check=True, capture_output=True)
+    return diff_output.stdout.decode("utf-8").split()
@@ -0,0 +1,124 @@
+"""
+Structured per instance logs. Events are buffered in memory and appended to {root_path}/logs/{instance_id}.jsonl
+from a worker thread, so logging never blocks the event loop. Only compact progress lines go to stdout.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import time
+from typing import AsyncIterator, Optional
+
+LOG_SETTINGS = {
+    "verbosity": 1,
+    "max_field_chars": 4000,
+    "max_bytes": 20 * 2**20,
+    "flush_every": 20,
+}
+
+current_log: contextvars.ContextVar[Optional["InstanceLog"]] = contextvars.ContextVar(
+    "current_log", default=None
+)
+
+
+def configure_logs(**settings) -> None:
+    """Override LOG_SETTINGS for the logs opened afterwards."""
+    unknown = set(settings) - set(LOG_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown log settings: {sorted(unknown)}")
+    LOG_SETTINGS.update(settings)
+
+
+def cap(value, max_chars: int):
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    value = str(value)
+    if len(value) <= max_chars:
+        return value
+    return f"{value[:max_chars]} ... [{len(value) - max_chars} characters truncated]"
+
+
+class InstanceLog:
+    """Buffered JSONL event sink for one instance."""
+
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.name = name
+        self.verbosity = LOG_SETTINGS["verbosity"]
+        self.max_field_chars = LOG_SETTINGS["max_field_chars"]
+        self.max_bytes = LOG_SETTINGS["max_bytes"]
+        self.flush_every = LOG_SETTINGS["flush_every"]
+        self.buffer: list[str] = []
+        self.written = 0
+        self.full = False
+        self.lock = asyncio.Lock()
+        self.flushing: Optional[asyncio.Task] = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def event(self, kind: str, level: int = 1, **fields) -> None:
+        """Record an event if the verbosity allows it. Events of level 0 are always recorded."""
+        if level > self.verbosity:
+            return
+        record = {"time": round(time.time(), 3), "event": kind}
+        record.update(
+            {key: cap(value, self.max_field_chars) for key, value in fields.items()}
+        )
+        self.buffer.append(json.dumps(record))
+        if len(self.buffer) >= self.flush_every and (
+            self.flushing is None or self.flushing.done()
+        ):
+            self.flushing = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self) -> None:
+        async with self.lock:
+            while self.buffer:
+                lines, self.buffer = self.buffer, []
+                await asyncio.to_thread(self.write, lines)
+
+    def write(self, lines: list[str]) -> None:
+        if self.full:
+            return
+        data = ""
+        for line in lines:
+            if self.written + len(data) + len(line) + 1 > self.max_bytes:
+                self.full = True
+                data += json.dumps(
+                    {"event": "log_truncated", "max_bytes": self.max_bytes}
+                )
+                data += "\n"
+                break
+            data += f"{line}\n"
+        with open(self.path, "a") as log_file:
+            log_file.write(data)
+        self.written += len(data)
+
+
+@contextlib.asynccontextmanager
+async def instance_log(path: str, name: str) -> AsyncIterator[InstanceLog]:
+    """Route the events logged by the enclosed code, and the tasks it starts, to a log file."""
+    log = InstanceLog(path, name)
+    token = current_log.set(log)
+    try:
+        yield log
+    finally:
+        current_log.reset(token)
+        await log.flush()
+
+
+def log_event(kind: str, level: int = 1, **fields) -> None:
+    """Record an event in the current instance log. Dropped when no log is active."""
+    log = current_log.get()
+    if log is not None:
+        log.event(kind, level, **fields)
+
+
+def progress(message: str, **fields) -> None:
+    """Print a compact progress line to stdout and record it in the current instance log."""
+    log = current_log.get()
+    if log is None:
+        print(message)
+        return
+    print(f"[{log.name}] {message}")
+    log.event("progress", 0, message=message, **fields)
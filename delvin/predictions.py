@@ -82,6 +82,7 @@ def save_prediction(
     model_name: str = "delvin",
     evaluation: DiffEvaluation = None,
     meta_evaluation: Optional[MetaEvaluation] = None,
+    gating: Optional[dict] = None,
 ) -> None:
     predictions_file_path = os.path.join(path, "predictions.json")
     with open(predictions_file_path, "r") as predictions_file:
@@ -95,6 +96,8 @@ def save_prediction(
     if evaluation:
         pred["evaluation"] = evaluation.model_dump()
         pred["meta_evaluation"] = meta_evaluation.model_dump()
+    if gating:
+        pred["gating"] = gating
     for existing_pred in predictions:
         if pred["instance_id"] == existing_pred["instance_id"]:
             existing_pred.update(pred)
@@ -103,3 +106,33 @@ def save_prediction(
         predictions.append(pred)
     with open(predictions_file_path, "w") as predictions_file:
         json.dump(predictions, predictions_file)
+
+
+def summarize_gating(path: str) -> str:
+    """Per evaluation gate: number of instances, solve rate and evaluator calls run and saved."""
+    predictions_file_path = os.path.join(path, "predictions.json")
+    with open(predictions_file_path, "r") as predictions_file:
+        predictions = json.load(predictions_file)
+
+    gates = {}
+    for prediction in predictions:
+        gating = prediction.get("gating")
+        if not gating or not prediction.get("evaluation"):
+            continue
+        stats = gates.setdefault(
+            gating["gate"], {"instances": 0, "correct": 0, "run": 0, "skipped": 0}
+        )
+        stats["instances"] += 1
+        stats["correct"] += int(prediction["evaluation"]["correct"])
+        stats["run"] += gating["evaluations_run"]
+        stats["skipped"] += gating["evaluations_skipped"]
+
+    lines = []
+    for gate, stats in gates.items():
+        total = stats["run"] + stats["skipped"]
+        lines.append(
+            f"{gate}: {stats['correct']}/{stats['instances']} correct "
+            f"({stats['correct'] / stats['instances']:.0%}), "
+            f"{stats['skipped']}/{total} evaluator calls saved"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,141 @@
+"""
+The prepare stage builds everything agents need before a run, so that no cloning, checkout or indexing
+sits on the critical path of the agent phase. Entries are grouped by (repo, base commit): for each pair
+the shared clone is fetched once, the instance workspaces are checked out, and the repo map and search
+index of the commit are built in a process pool. Artifacts already on disk are kept, so an interrupted
+prepare resumes where it stopped.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Optional
+
+from delvin import Entry
+from delvin.agent.repo_map import build_repo_map
+from delvin.agent.search import build_search_index
+from delvin.log import progress
+from delvin.predictions import get_prediction
+from delvin.workspaces import WorkspaceManager
+
+
+def write_atomically(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as file:
+        file.write(content)
+    os.replace(f"{path}.tmp", path)
+
+
+def build_artifacts(
+    workspace: str, repo_map_path: str, search_index_path: str
+) -> list[str]:
+    """Build the per commit artifacts missing on disk from a workspace at the commit. Returns the ones built."""
+    built = []
+    if not os.path.exists(repo_map_path):
+        write_atomically(repo_map_path, build_repo_map(workspace))
+        built.append("repo map")
+    if not os.path.exists(search_index_path):
+        write_atomically(search_index_path, json.dumps(build_search_index(workspace)))
+        built.append("search index")
+    return built
+
+
+def group_by_commit(entries: list[Entry]) -> dict[tuple[str, str], list[Entry]]:
+    pairs = defaultdict(list)
+    for entry in entries:
+        pairs[(entry.repo, entry.base_commit)].append(entry)
+    return dict(pairs)
+
+
+async def prepare_commit(
+    repo: str,
+    commit_hash: str,
+    entries: list[Entry],
+    workspaces: WorkspaceManager,
+    executor: Executor,
+    attempts: int = 1,
+) -> list[str]:
+    """
+    Fetch the commit, check out the workspaces of its entries and build its artifacts.
+    The workspaces are kept out of eviction, they are there for the fix phase.
+    """
+    await workspaces.warm_repo(repo, commit_hash)
+    paths = []
+    for entry in entries:
+        try:
+            paths += await workspaces.acquire(entry, attempts)
+        finally:
+            workspaces.release(entry.instance_id, evictable=False)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        build_artifacts,
+        paths[0],
+        workspaces.repo_map_path(repo, commit_hash),
+        workspaces.search_index_path(repo, commit_hash),
+    )
+
+
+async def prepare(
+    entries: list[Entry],
+    root_path: str,
+    workspaces: Optional[WorkspaceManager] = None,
+    attempts: int = 1,
+    workers: Optional[int] = None,
+    concurrency: int = 8,
+) -> int:
+    """
+    Prepare the entries that have no prediction yet, `concurrency` (repo, base commit) pairs at a time.
+    Returns the number of pairs that failed.
+    """
+    workspaces = workspaces or WorkspaceManager(root_path)
+    pending = [
+        entry
+        for entry in entries
+        if get_prediction(entry.instance_id, f"{root_path}/predictions") is None
+    ]
+    pairs = group_by_commit(pending)
+    progress(
+        f"Preparing {len(pairs)} (repo, base commit) pairs for {len(pending)} instances, "
+        f"{len(entries) - len(pending)} instances already have a prediction"
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+    failed = 0
+
+    async def prepare_pair(repo: str, commit_hash: str, pair_entries: list[Entry]):
+        nonlocal done, failed
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                built = await prepare_commit(
+                    repo, commit_hash, pair_entries, workspaces, executor, attempts
+                )
+            except Exception as e:
+                failed += 1
+                done += 1
+                progress(f"[{done}/{len(pairs)}] {repo}@{commit_hash[:8]} failed: {e}")
+                return
+            done += 1
+            progress(
+                f"[{done}/{len(pairs)}] {repo}@{commit_hash[:8]}: {len(pair_entries)} instances, "
+                f"built {', '.join(built) or 'nothing new'} in {time.monotonic() - started:.1f}s"
+            )
+
+    # Spawned rather than forked, the event loop and its subprocess watchers are not fork safe
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        await asyncio.gather(
+            *(
+                prepare_pair(repo, commit_hash, pair_entries)
+                for (repo, commit_hash), pair_entries in pairs.items()
+            )
+        )
+    await workspaces.close()
+    progress(f"Prepared {len(pairs) - failed}/{len(pairs)} pairs")
+    return failed
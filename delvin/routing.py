@@ -0,0 +1,253 @@
+"""
+Per function model routing. The @fn functions are registered once per model they can be routed to, under
+the path {function}/{model}, so every call goes to the primary model of its route, or to the fallback
+model while the primary is too slow or failing too often. Latency, errors and estimated token cost are
+accounted per model.
+"""
+
+import json
+import re
+import statistics
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+
+from opperai import fn
+from opperai.utils import convert_function_call_to_json
+from pydantic import BaseModel, Field
+
+from delvin.log import log_event
+
+DEFAULT_MODEL = "openai/gpt-4o"
+CHARS_PER_TOKEN = 4
+
+
+class Route(BaseModel):
+    model: str = Field(..., description="Model serving the function.")
+    fallback: Optional[str] = Field(
+        None, description="Model used while the primary one is degraded."
+    )
+
+
+class ModelPrice(BaseModel):
+    input: float = Field(..., description="USD per million input tokens.")
+    output: float = Field(..., description="USD per million output tokens.")
+
+
+class RoutingConfig(BaseModel):
+    default: Route = Field(
+        default_factory=lambda: Route(model=DEFAULT_MODEL),
+        description="Route of the functions without a route of their own.",
+    )
+    routes: dict[str, Route] = Field(
+        default_factory=lambda: {
+            "smart_code_replace": Route(
+                model="openai/gpt-4o-mini", fallback=DEFAULT_MODEL
+            ),
+        },
+        description="Routes per function name.",
+    )
+    p95_threshold: float = Field(
+        60.0, description="p95 latency in seconds beyond which a model is degraded."
+    )
+    error_rate_threshold: float = Field(
+        0.25, description="Error rate beyond which a model is degraded."
+    )
+    window: int = Field(50, description="Number of recent calls per model considered.")
+    min_calls: int = Field(
+        10, description="Recent calls needed before a model can be degraded."
+    )
+    cooldown: float = Field(
+        300.0, description="Seconds a degraded model is skipped before it is retried."
+    )
+    prices: dict[str, ModelPrice] = Field(
+        default_factory=lambda: {
+            "openai/gpt-4o": ModelPrice(input=2.5, output=10.0),
+            "openai/gpt-4o-mini": ModelPrice(input=0.15, output=0.6),
+        },
+        description="Prices per model, used to estimate costs.",
+    )
+
+
+def model_path(model: str) -> str:
+    """Model name as a function path segment."""
+    return re.sub(r"[^a-zA-Z0-9_-]", "_", model)
+
+
+def estimate_tokens(value: Any) -> int:
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    if not isinstance(value, str):
+        value = json.dumps(value)
+    return len(value) // CHARS_PER_TOKEN
+
+
+class ModelStats:
+    """Totals of every call to a model, and latency and failures of the most recent ones."""
+
+    def __init__(self, window: int):
+        self.recent: deque[tuple[float, bool]] = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def record(
+        self, seconds: float, failed: bool, input_tokens: int, output_tokens: int
+    ) -> None:
+        self.recent.append((seconds, failed))
+        self.calls += 1
+        self.errors += failed
+        self.seconds += seconds
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+
+    def p95(self) -> float:
+        latencies = [seconds for seconds, _ in self.recent]
+        if len(latencies) < 2:
+            return latencies[0] if latencies else 0.0
+        return statistics.quantiles(latencies, n=20)[-1]
+
+    def error_rate(self) -> float:
+        if not self.recent:
+            return 0.0
+        return sum(failed for _, failed in self.recent) / len(self.recent)
+
+
+class ModelRouter:
+    def __init__(self, config: Optional[RoutingConfig] = None):
+        self.config = config or RoutingConfig()
+        self.stats: dict[str, ModelStats] = {}
+        self.degraded_until: dict[str, float] = {}
+        self.variants: dict[tuple[str, str], Callable] = {}
+
+    def route(self, function: str) -> Route:
+        return self.config.routes.get(function, self.config.default)
+
+    def model_stats(self, model: str) -> ModelStats:
+        if model not in self.stats:
+            self.stats[model] = ModelStats(self.config.window)
+        return self.stats[model]
+
+    def is_degraded(self, model: str) -> bool:
+        """Whether calls should skip the model. A model gets a fresh window once its cooldown is over."""
+        until = self.degraded_until.get(model)
+        if until is not None:
+            if time.monotonic() < until:
+                return True
+            del self.degraded_until[model]
+            self.model_stats(model).recent.clear()
+            return False
+        stats = self.model_stats(model)
+        if len(stats.recent) < self.config.min_calls:
+            return False
+        p95, error_rate = stats.p95(), stats.error_rate()
+        if (
+            p95 > self.config.p95_threshold
+            or error_rate > self.config.error_rate_threshold
+        ):
+            self.degraded_until[model] = time.monotonic() + self.config.cooldown
+            log_event("model_degraded", 0, model=model, p95=p95, error_rate=error_rate)
+            return True
+        return False
+
+    def select(self, function: str) -> str:
+        route = self.route(function)
+        if route.fallback and self.is_degraded(route.model):
+            return route.fallback
+        return route.model
+
+    def variant(self, function: Callable, model: str) -> Callable:
+        """The @fn function registered to run on the model."""
+        key = (function.__name__, model)
+        if key not in self.variants:
+            self.variants[key] = fn(
+                path=f"{function.__name__}/{model_path(model)}", model=model
+            )(function.__wrapped__)
+        return self.variants[key]
+
+    async def call_model(self, function: Callable, model: str, *args, **kwargs):
+        variant = self.variant(function, model)
+        input_tokens = estimate_tokens(
+            convert_function_call_to_json(function.__wrapped__, *args, **kwargs)
+        )
+        started = time.monotonic()
+        try:
+            answer = await variant(*args, **kwargs)
+        except Exception:
+            # API errors, but also the httpx timeouts and connection errors the SDK lets through.
+            # Cancellations are not failures of the model and are not recorded.
+            seconds = time.monotonic() - started
+            self.model_stats(model).record(seconds, True, input_tokens, 0)
+            log_event(
+                "model_call",
+                function=function.__name__,
+                model=model,
+                seconds=round(seconds, 3),
+                failed=True,
+            )
+            raise
+        seconds = time.monotonic() - started
+        self.model_stats(model).record(
+            seconds, False, input_tokens, estimate_tokens(answer)
+        )
+        log_event(
+            "model_call",
+            function=function.__name__,
+            model=model,
+            seconds=round(seconds, 3),
+            failed=False,
+        )
+        return answer
+
+    async def call(self, function: Callable, *args, **kwargs):
+        """Call an @fn function on the model its route selects, retrying once on the fallback if it fails."""
+        route = self.route(function.__name__)
+        model = self.select(function.__name__)
+        try:
+            return await self.call_model(function, model, *args, **kwargs)
+        except Exception as e:
+            if route.fallback is None or model == route.fallback:
+                raise
+            log_event(
+                "model_retry",
+                0,
+                function=function.__name__,
+                model=model,
+                fallback=route.fallback,
+                error=str(e),
+            )
+            return await self.call_model(function, route.fallback, *args, **kwargs)
+
+    def cost(self, model: str) -> Optional[float]:
+        price = self.config.prices.get(model)
+        if price is None:
+            return None
+        stats = self.model_stats(model)
+        return (
+            stats.input_tokens * price.input + stats.output_tokens * price.output
+        ) / 1e6
+
+    def summary(self) -> str:
+        """Calls, latency, errors and estimated cost per model."""
+        lines = ["model\tcalls\terrors\tmean_s\trecent_p95_s\test_cost_usd"]
+        for model, stats in sorted(self.stats.items()):
+            if not stats.calls:
+                continue
+            cost = self.cost(model)
+            lines.append(
+                f"{model}\t{stats.calls}\t{stats.errors}\t{stats.seconds / stats.calls:.2f}"
+                f"\t{stats.p95():.2f}\t{'-' if cost is None else f'{cost:.2f}'}"
+            )
+        return "\n".join(lines)
+
+
+router = ModelRouter()
+
+
+def configure_routing(config: RoutingConfig) -> None:
+    """Replace the routing of the calls made afterwards."""
+    router.config = config
+    router.stats = {}
+    router.degraded_until = {}
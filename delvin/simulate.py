@@ -0,0 +1,283 @@
+"""
+A local stand in for the Opper backend, to load test the orchestration without spending model quota.
+
+The simulated clients are installed as the opperai client singletons, so every @fn function, span and
+metric goes through the real SDK code paths (input serialization included) but gets answered locally,
+after a latency drawn from a lognormal distribution and with configurable error and rate limit rates.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import random
+import re
+import time
+from collections import Counter
+from typing import Any, Iterator, Optional
+from uuid import uuid4
+
+from opperai import AsyncClient, Client
+from opperai.types.exceptions import APIError, RateLimitError
+from pydantic import BaseModel, Field
+
+from delvin.agent.functions import Evaluation
+from delvin.predictions import DiffEvaluation, MetaEvaluation
+
+SEARCH_REGEXES = ["def ", "class ", "import ", "return "]
+SEARCH_FILE = re.compile(r"^- (\S+) \(\d+ match")
+SEARCH_LINE = re.compile(r"^ +line (\d+) : ")
+VIEW_LINE = re.compile(r"^(\d+)\| (.*\S.*)$", re.MULTILINE)
+
+
+class SimulationConfig(BaseModel):
+    latency_median: float = Field(2.0, description="Median LLM latency in seconds.")
+    latency_sigma: float = Field(
+        0.5, description="Sigma of the lognormal latency distribution."
+    )
+    function_latency_median: dict[str, float] = Field(
+        default_factory=dict,
+        description="Median latency overrides per function path, e.g. get_action or get_action/openai_gpt-4o.",
+    )
+    error_rate: float = Field(
+        0.0, description="Share of calls failing with an API error."
+    )
+    rate_limit_rate: float = Field(
+        0.0, description="Share of calls failing with a 429 rate limit error."
+    )
+    off_track_rate: float = Field(
+        0.1, description="Share of evaluations saying the agent is off track."
+    )
+    span_latency: float = Field(
+        0.0,
+        description="Blocking latency of span calls, which the SDK makes with its synchronous client.",
+    )
+    action_mix: dict[str, float] = Field(
+        default_factory=lambda: {
+            "search": 0.3,
+            "view_file": 0.3,
+            "explore": 0.1,
+            "repo_map": 0.05,
+            "edits": 0.2,
+            "submit": 0.05,
+        }
+    )
+    script: list[str] = Field(
+        default_factory=list,
+        description="Action names to play in order instead of drawing from the mix.",
+    )
+    seed: int = 0
+
+
+class SimulatedResponse(BaseModel):
+    json_payload: Any
+    span_id: str
+
+
+class SimulatedSpans:
+    def __init__(self, config: SimulationConfig):
+        self.config = config
+
+    def create(self, span, **kwargs) -> str:
+        time.sleep(self.config.span_latency)
+        return span.uuid
+
+    def update(self, span_uuid, **kwargs) -> None:
+        time.sleep(self.config.span_latency)
+
+    async def save_metric(self, span_uuid, metric) -> None:
+        return None
+
+
+class SimulatedFunctions:
+    def __init__(self, backend: "SimulatedBackend"):
+        self.backend = backend
+
+    def create(self, function, **kwargs):
+        return function
+
+    async def chat(self, function_path: str, payload, **kwargs) -> SimulatedResponse:
+        return await self.backend.chat(function_path, payload)
+
+
+class SimulatedClient:
+    def __init__(self, backend: "SimulatedBackend"):
+        self.functions = SimulatedFunctions(backend)
+        self.spans = SimulatedSpans(backend.config)
+        self.api_key = "simulated"
+        self.api_url = "simulated"
+
+
+class SimulatedBackend:
+    """Answers the @fn functions of delvin with schema valid objects."""
+
+    def __init__(self, config: SimulationConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.client = SimulatedClient(self)
+
+    def latency(self, function_path: str) -> float:
+        overrides = self.config.function_latency_median
+        median = overrides.get(
+            function_path,
+            overrides.get(function_path.split("/")[0], self.config.latency_median),
+        )
+        return self.random.lognormvariate(0, self.config.latency_sigma) * median
+
+    async def chat(self, function_path: str, payload) -> SimulatedResponse:
+        self.calls[function_path.split("/")[0]] += 1
+        await asyncio.sleep(self.latency(function_path))
+        draw = self.random.random()
+        if draw < self.config.rate_limit_rate:
+            self.errors["rate_limit"] += 1
+            raise RateLimitError(f"Simulated rate limit on {function_path}")
+        if draw < self.config.rate_limit_rate + self.config.error_rate:
+            self.errors["api_error"] += 1
+            raise APIError(f"Simulated error on {function_path}")
+
+        inputs = json.loads(payload.messages[0].content)
+        # Routed functions are registered as {function}/{model}
+        answer = getattr(self, function_path.split("/")[0])(**inputs)
+        if isinstance(answer, BaseModel):
+            answer = answer.model_dump()
+        return SimulatedResponse(json_payload=answer, span_id=str(uuid4()))
+
+    def get_action(self, trajectory: dict, **inputs) -> dict:
+        actions = trajectory["actions"]
+        if self.config.script:
+            name = self.config.script[len(actions) % len(self.config.script)]
+        else:
+            names = list(self.config.action_mix)
+            weights = list(self.config.action_mix.values())
+            name = self.random.choices(names, weights)[0]
+        results = [step["result"] for step in reversed(actions)]
+        locations = [location for r in results for location in search_locations(r)]
+        views = [
+            (step["action"]["action_input"]["file_path"], m.groups())
+            for step in reversed(actions)
+            if step["action"]["action_name"] == "view_file"
+            for m in [VIEW_LINE.search(step["result"])]
+            if m
+        ]
+
+        if name == "edits" and not views:
+            name = "view_file"
+        if name in ["view_file", "explore"] and not locations:
+            name = "search"
+
+        if name == "search":
+            action_input = {"regex": self.random.choice(SEARCH_REGEXES)}
+        elif name == "view_file":
+            action_input = self.view_input(self.random.choice(locations[:20]))
+        elif name == "explore":
+            action_input = {
+                "searches": [
+                    {"regex": regex} for regex in self.random.sample(SEARCH_REGEXES, 2)
+                ],
+                "views": [
+                    self.view_input(location)
+                    for location in self.random.sample(
+                        locations[:20], min(2, len(locations))
+                    )
+                ],
+            }
+        elif name == "repo_map":
+            action_input = {"directory": ""}
+        elif name == "edits":
+            file_path, (line_number, line) = views[0]
+            indent = line[: len(line) - len(line.lstrip())]
+            action_input = {
+                "edits": [
+                    {
+                        "file_path": file_path,
+                        "seen_all_needed_code": True,
+                        "no_other_file_viewing_needed": True,
+                        "edit_contains_all_needed_code": True,
+                        "short_description": "Simulated edit",
+                        "code_to_replace": f"{line}\n",
+                        "start_line": int(line_number),
+                        "end_line": int(line_number),
+                        "new_code": f"{indent}# simulated edit\n{line}\n",
+                    }
+                ]
+            }
+        else:
+            action_input = {"done": True}
+        return {
+            "thoughts": f"Simulated {name}",
+            "learning": None,
+            "action_name": name,
+            "action_input": action_input,
+        }
+
+    def view_input(self, location: tuple[str, str]) -> dict:
+        file_path, line_number = location
+        return {
+            "file_path": file_path,
+            "cursor_line": int(line_number),
+            "before": 100,
+            "after": 100,
+        }
+
+    def evaluate_action(self, **inputs) -> Evaluation:
+        right_track = self.random.random() >= self.config.off_track_rate
+        return Evaluation(
+            observations="Simulated evaluation",
+            right_track=right_track,
+            feedback=None if right_track else "Simulated feedback",
+        )
+
+    def smart_code_replace(
+        self, code_snippet: str, to_replace: str, new_code: str
+    ) -> str:
+        return code_snippet.replace(to_replace, new_code, 1)
+
+    def evaluate_fix(self, **inputs) -> DiffEvaluation:
+        correct = self.random.random() < 0.25
+        return DiffEvaluation(
+            observations="Simulated evaluation",
+            score=10 if correct else 3,
+            pass_tests=correct,
+            correct=correct,
+        )
+
+    def meta_evaluation(self, **inputs) -> MetaEvaluation:
+        return MetaEvaluation(
+            observations="Simulated meta evaluation", feedback="Simulated feedback"
+        )
+
+
+def search_locations(result: str) -> list[tuple[str, str]]:
+    """(file path, line number) of the matching lines listed in a search result."""
+    locations = []
+    file_path = None
+    for line in result.splitlines():
+        if match := SEARCH_FILE.match(line):
+            file_path = match.group(1)
+        elif (match := SEARCH_LINE.match(line)) and file_path:
+            locations.append((file_path, match.group(1)))
+    return locations
+
+
+@contextlib.contextmanager
+def simulated_backend(
+    config: Optional[SimulationConfig] = None,
+) -> Iterator[SimulatedBackend]:
+    """Answer every Opper call made in the block with a simulated backend."""
+    backend = SimulatedBackend(config or SimulationConfig())
+    previous = (
+        Client._instance,
+        AsyncClient._instance,
+        os.environ.get("OPPER_API_KEY"),
+    )
+    os.environ.setdefault("OPPER_API_KEY", "simulated")
+    Client._instance = backend.client
+    AsyncClient._instance = backend.client
+    try:
+        yield backend
+    finally:
+        Client._instance, AsyncClient._instance, api_key = previous
+        if api_key is None:
+            os.environ.pop("OPPER_API_KEY", None)
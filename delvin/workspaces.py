@@ -0,0 +1,151 @@
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Optional
+
+from delvin import Entry
+from delvin.github import (
+    clone_local_workspace,
+    clone_repo,
+    ensure_commit,
+    remove_folder,
+)
+from delvin.log import progress
+
+
+async def folder_size(folder: str) -> int:
+    """Disk usage of a folder in bytes."""
+    process = await asyncio.create_subprocess_exec(
+        "du",
+        "-sk",
+        folder,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, _ = await process.communicate()
+    try:
+        return int(stdout.split()[0]) * 1024
+    except (IndexError, ValueError):
+        return 0
+
+
+class WorkspaceManager:
+    """
+    Hands out the workspaces agents work in and cleans them up.
+
+    Every repo is cloned once under {root_path}/repos/{repo} and kept there, and its repo map and search index
+    are built once per base commit. Instance workspaces live under
+    {root_path}/entries/{instance_id}/{attempt}/{repo} and share the objects of that clone. Once an instance
+    is released its workspaces become candidates for eviction, least recently used first, whenever the
+    entries take more than quota_bytes on disk. Eviction runs in the background, call close() to wait for it.
+    """
+
+    def __init__(self, root_path: str, quota_bytes: Optional[int] = None):
+        self.root_path = root_path
+        self.quota_bytes = quota_bytes
+        self.active: set[str] = set()
+        self.finished: OrderedDict[str, int] = OrderedDict()
+        self.repo_locks: dict[str, asyncio.Lock] = {}
+        self.eviction_lock = asyncio.Lock()
+        self.cleanups: set[asyncio.Task] = set()
+        self.load_finished()
+
+    def load_finished(self) -> None:
+        """Pick up workspaces left by previous runs as finished, oldest first. Sizes are measured lazily."""
+        entries_path = os.path.join(self.root_path, "entries")
+        if not os.path.isdir(entries_path):
+            return
+        instance_ids = sorted(
+            os.listdir(entries_path),
+            key=lambda name: os.path.getmtime(os.path.join(entries_path, name)),
+        )
+        for instance_id in instance_ids:
+            self.finished[instance_id] = -1
+
+    def repo_path(self, repo: str) -> str:
+        return f"{self.root_path}/repos/{repo}"
+
+    def entry_path(self, instance_id: str) -> str:
+        return f"{self.root_path}/entries/{instance_id}"
+
+    def workspace_path(self, entry: Entry, attempt: int = 0) -> str:
+        return f"{self.entry_path(entry.instance_id)}/{attempt}/{entry.repo}"
+
+    def repo_map_path(self, repo: str, commit_hash: str) -> str:
+        return f"{self.root_path}/repo_maps/{repo}/{commit_hash}.txt"
+
+    def search_index_path(self, repo: str, commit_hash: str) -> str:
+        return f"{self.root_path}/search_indexes/{repo}/{commit_hash}.json"
+
+    async def warm_repo(self, repo: str, commit_hash: str) -> str:
+        """Make sure the shared clone of the repo exists and contains the commit."""
+        lock = self.repo_locks.setdefault(repo, asyncio.Lock())
+        async with lock:
+            repo_path = self.repo_path(repo)
+            await clone_repo(repo, repo_path)
+            await ensure_commit(repo_path, commit_hash)
+        return repo_path
+
+    async def acquire(self, entry: Entry, attempts: int = 1) -> list[str]:
+        """Create or reset the workspaces for the entry at its base commit and mark them active."""
+        self.active.add(entry.instance_id)
+        self.finished.pop(entry.instance_id, None)
+        try:
+            repo_path = await self.warm_repo(entry.repo, entry.base_commit)
+            workspaces = [
+                self.workspace_path(entry, attempt) for attempt in range(attempts)
+            ]
+            await asyncio.gather(
+                *(
+                    clone_local_workspace(repo_path, entry.base_commit, workspace)
+                    for workspace in workspaces
+                )
+            )
+        except Exception:
+            self.release(entry.instance_id)
+            raise
+        return workspaces
+
+    def hold(self, instance_ids: list[str]) -> None:
+        """Keep workspaces left by previous runs, e.g. by prepare, out of eviction until they are released."""
+        for instance_id in instance_ids:
+            self.finished.pop(instance_id, None)
+
+    def release(self, instance_id: str, evictable: bool = True) -> None:
+        """
+        Mark the workspaces of an instance as finished and evict old ones in the background.
+        Workspaces released as not evictable stay on disk for a later run to use.
+        """
+        self.active.discard(instance_id)
+        if not evictable:
+            return
+        self.finished[instance_id] = -1
+        self.finished.move_to_end(instance_id)
+        if self.quota_bytes is not None:
+            task = asyncio.create_task(self.evict())
+            self.cleanups.add(task)
+            task.add_done_callback(self.cleanups.discard)
+
+    async def evict(self) -> None:
+        """Remove finished workspaces in LRU order until the entries fit in the quota."""
+        async with self.eviction_lock:
+            for instance_id, size in list(self.finished.items()):
+                if size < 0:
+                    size = await folder_size(self.entry_path(instance_id))
+                    if instance_id in self.finished:
+                        self.finished[instance_id] = size
+            active_sizes = await asyncio.gather(
+                *(folder_size(self.entry_path(i)) for i in list(self.active))
+            )
+            usage = sum(active_sizes) + sum(self.finished.values())
+            while usage > self.quota_bytes and self.finished:
+                instance_id, size = self.finished.popitem(last=False)
+                await remove_folder(self.entry_path(instance_id))
+                usage -= size
+                progress(
+                    f"Evicted workspaces of {instance_id}, {usage // 2**20}MB of entries left on disk"
+                )
+
+    async def close(self) -> None:
+        """Wait for background cleanups to finish."""
+        await asyncio.gather(*self.cleanups, return_exceptions=True)
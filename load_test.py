@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+
+from delvin import Entry
+
+os.environ["OPPER_PROJECT"] = "delvin-load-test"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Load test the orchestration against a simulated LLM backend."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[25, 100, 250, 500],
+        help="Numbers of concurrent agents to test",
+    )
+    parser.add_argument(
+        "--instances_per_agent",
+        type=float,
+        default=2,
+        help="Instances to run per concurrent agent slot",
+    )
+    parser.add_argument(
+        "--source_repo",
+        type=str,
+        default=os.path.dirname(os.path.abspath(__file__)),
+        help="Local git repository every simulated instance works on",
+    )
+    parser.add_argument("--latency_median", type=float, default=2.0)
+    parser.add_argument("--latency_sigma", type=float, default=0.5)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0)
+    parser.add_argument("--span_latency", type=float, default=0.0)
+    parser.add_argument(
+        "--script",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Action names to play in order instead of the default action mix",
+    )
+    parser.add_argument("--attempts", type=int, default=1)
+    parser.add_argument("--gate", type=str, default="always")
+    return parser.parse_args()
+
+
+def current_rss() -> int:
+    """Resident memory of the process in bytes, 0 where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+async def monitor_event_loop(
+    lag_samples: list[float], rss_samples: list[int], interval: float = 0.05
+):
+    """Measure how late the event loop wakes up a sleeping task, and the memory in use."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag_samples.append(loop.time() - started - interval)
+        rss_samples.append(current_rss())
+
+
+def percentile(samples: list[float], q: int) -> float:
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100)[q - 1]
+
+
+async def run_level(
+    args: argparse.Namespace, backend, concurrency: int, root_path: str
+) -> dict:
+    from delvin.fix import init_predictions_folder
+    from delvin.github import clone_local_workspace
+    from delvin.log import configure_logs
+    from delvin.workspaces import WorkspaceManager
+    from main import fix_entries, parse_args as parse_main_args
+
+    commit = subprocess.run(
+        ["git", "-C", args.source_repo, "rev-parse", "HEAD"],
+        check=True,
+        capture_output=True,
+    )
+    commit = commit.stdout.decode().strip()
+    repo = f"local/{os.path.basename(args.source_repo)}"
+    entries = [
+        Entry(
+            repo=repo,
+            base_commit=commit,
+            problem_statement="Simulated problem",
+            hints_text="",
+            instance_id=f"simulated-{index}",
+            patch="",
+            test_patch="",
+        )
+        for index in range(int(concurrency * args.instances_per_agent))
+    ]
+
+    configure_logs(verbosity=0)
+    init_predictions_folder(f"{root_path}/predictions")
+    # Seed the shared repo clone so the workspace manager never reaches out to GitHub
+    workspaces = WorkspaceManager(root_path)
+    await clone_local_workspace(args.source_repo, commit, workspaces.repo_path(repo))
+    main_args = parse_main_args(
+        [
+            "--root_path",
+            root_path,
+            "--attempts",
+            str(args.attempts),
+            "--gate",
+            args.gate,
+        ]
+    )
+    lag_samples: list[float] = []
+    rss_samples: list[int] = [current_rss()]
+    monitor = asyncio.create_task(monitor_event_loop(lag_samples, rss_samples))
+    calls_before = sum(backend.calls.values())
+    steps_before = backend.calls["get_action"]
+    errors_before = sum(backend.errors.values())
+    started = time.monotonic()
+    await fix_entries(entries, main_args, workspaces, batch_size=concurrency)
+    await workspaces.close()
+    elapsed = time.monotonic() - started
+    monitor.cancel()
+    calls = sum(backend.calls.values()) - calls_before
+
+    return {
+        "concurrency": concurrency,
+        "instances": len(entries),
+        "seconds": elapsed,
+        "instances_per_minute": len(entries) / elapsed * 60,
+        "llm_calls_per_second": calls / elapsed,
+        "steps": backend.calls["get_action"] - steps_before,
+        "errors": sum(backend.errors.values()) - errors_before,
+        "lag_p50_ms": percentile(lag_samples, 50) * 1000,
+        "lag_p95_ms": percentile(lag_samples, 95) * 1000,
+        "lag_max_ms": max(lag_samples, default=0) * 1000,
+        # Peak of this level only, ru_maxrss would carry over the peak of earlier levels
+        "peak_rss_mb": max(rss_samples) / 2**20,
+        # Freed memory stays with the process, the growth shows what this level added
+        "rss_growth_mb": (max(rss_samples) - rss_samples[0]) / 2**20,
+    }
+
+
+async def main(args: argparse.Namespace):
+    from delvin.routing import router
+    from delvin.simulate import SimulationConfig, simulated_backend
+
+    config = SimulationConfig(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        span_latency=args.span_latency,
+        script=args.script,
+    )
+    results = []
+    # The SDK keeps the client it was first called with, so one backend serves every level
+    with simulated_backend(config) as backend:
+        for concurrency in args.concurrency:
+            with tempfile.TemporaryDirectory(prefix="delvin-load-") as root_path:
+                results.append(await run_level(args, backend, concurrency, root_path))
+
+    columns = list(results[0])
+    print("\t".join(columns))
+    for result in results:
+        print(
+            "\t".join(
+                f"{result[column]:.1f}"
+                if isinstance(result[column], float)
+                else str(result[column])
+                for column in columns
+            )
+        )
+    print(router.summary())
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,74 +1,150 @@
 import argparse
 import asyncio
 import os
-
-from datasets import load_dataset
+from typing import Optional
 
 from delvin import Entry
-from delvin.fix import (
-    fix,
-    init_predictions_folder,
-)
+from delvin.agent.gating import GATES
 
 os.environ["OPPER_PROJECT"] = "delvin"
-os.environ["OPPER_DEFAULT_MODEL"] = "openai/gpt-4o"
-
-# Set up command line arguments
-parser = argparse.ArgumentParser(
-    description="Run the fixing process with custom parameters."
-)
-parser.add_argument(
-    "--root_path",
-    type=str,
-    default="/tmp/delvin",
-    help="Root path for storing predictions",
-)
-parser.add_argument(
-    "--dataset_name",
-    type=str,
-    default="princeton-nlp/SWE-bench_Lite",
-    help="Name of the dataset to load",
-)
-parser.add_argument("--split", type=str, default="dev", help="Dataset split to use")
-
-args = parser.parse_args()
-
-root_path = args.root_path
-predictions_directory = f"{root_path}/predictions"
 
 
-def get_entry(dataset, index, split="dev"):
-    raw = dataset[split][index]
-    return Entry(
-        repo=raw["repo"],
-        base_commit=raw["base_commit"],
-        problem_statement=raw["problem_statement"],
-        hints_text=raw["hints_text"],
-        instance_id=raw["instance_id"],
-        test_patch=raw["test_patch"],
-        patch=raw["patch"],
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run the fixing process with custom parameters."
+    )
+    parser.add_argument(
+        "command",
+        type=str,
+        nargs="?",
+        choices=["fix", "prepare"],
+        default="fix",
+        help="fix the selected instances, or only prepare their workspaces, repo maps and search indexes",
+    )
+    parser.add_argument(
+        "--root_path",
+        type=str,
+        default="/tmp/delvin",
+        help="Root path for storing predictions",
+    )
+    parser.add_argument(
+        "--dataset_name",
+        type=str,
+        default="princeton-nlp/SWE-bench_Lite",
+        help="Name of the dataset to load",
+    )
+    parser.add_argument("--split", type=str, default="dev", help="Dataset split to use")
+    parser.add_argument(
+        "--attempts",
+        type=int,
+        default=1,
+        help="Number of concurrent attempts per instance, the best ranked diff is kept",
+    )
+    parser.add_argument(
+        "--attempt_budget",
+        type=float,
+        default=None,
+        help="Wall time budget in seconds for the attempts of an instance",
+    )
+    parser.add_argument(
+        "--no_early_stop",
+        action="store_true",
+        help="Let all attempts run instead of stopping at the first lint clean submission",
+    )
+    parser.add_argument(
+        "--workspace_quota_gb",
+        type=float,
+        default=None,
+        help="Disk quota for instance workspaces, finished ones are evicted beyond it",
+    )
+    parser.add_argument(
+        "--instance_ids",
+        type=str,
+        nargs="*",
+        default=None,
+        help="Only fix these instances",
+    )
+    parser.add_argument(
+        "--repos",
+        type=str,
+        nargs="*",
+        default=None,
+        help="Only fix instances from these repos, e.g. django/django",
     )
+    parser.add_argument(
+        "--start", type=int, default=0, help="Index of the first row to consider"
+    )
+    parser.add_argument(
+        "--end", type=int, default=None, help="Index after the last row to consider"
+    )
+    parser.add_argument(
+        "--inject_repo_map",
+        action="store_true",
+        help="Give agents a trimmed map of the repository modules up front",
+    )
+    parser.add_argument(
+        "--log_verbosity",
+        type=int,
+        default=1,
+        choices=[0, 1, 2],
+        help="Detail of the per instance logs in {root_path}/logs: 0 for steps only, 2 for code edits and views",
+    )
+    parser.add_argument(
+        "--log_max_field_chars",
+        type=int,
+        default=4000,
+        help="Logged fields longer than this are truncated",
+    )
+    parser.add_argument(
+        "--gate",
+        type=str,
+        choices=list(GATES),
+        default="always",
+        help="Policy deciding which actions go through the evaluator",
+    )
+    parser.add_argument(
+        "--routing_config",
+        type=str,
+        default=None,
+        help="JSON file with the model routes per function, fallback thresholds and prices",
+    )
+    parser.add_argument(
+        "--prepare_workers",
+        type=int,
+        default=None,
+        help="Processes building repo maps and search indexes in the prepare command",
+    )
+    return parser.parse_args(argv)
 
 
 async def fix_entries(
-    dataset, split="dev", indices=None, batch_size=3, overwrite=False
+    entries: list[Entry],
+    args: argparse.Namespace,
+    workspaces,
+    batch_size=3,
+    overwrite=False,
 ):
-    if not indices:
-        indices = range(len(dataset[split]))
+    from delvin.fix import fix
 
-    async def process_entry(index):
-        print(f"=======Fixing entry {index}=========")
+    async def process_entry(entry: Entry):
+        print(f"=======Fixing entry {entry.instance_id}=========")
         try:
             await fix(
-                get_entry(dataset, index, split),
-                root_path,
+                entry,
+                args.root_path,
                 overwrite=overwrite,
+                attempts=args.attempts,
+                early_stop=not args.no_early_stop,
+                budget=args.attempt_budget,
+                workspaces=workspaces,
+                gate=GATES[args.gate](),
+                inject_repo_map=args.inject_repo_map,
             )
         except Exception as e:
-            print(f"Error fixing entry {index}: {e}")
-        print(f"=======Done entry {index}=========")
+            print(f"Error fixing entry {entry.instance_id}: {e}")
+        print(f"=======Done entry {entry.instance_id}=========")
 
-    tasks = [process_entry(index) for index in indices]
+    tasks = [process_entry(entry) for entry in entries]
     semaphore = asyncio.Semaphore(batch_size)
 
     async def sem_task(task):
@@ -78,10 +154,60 @@ async def fix_entries(
     await asyncio.gather(*(sem_task(task) for task in tasks))
 
 
-async def main():
+async def main(args: argparse.Namespace):
+    # opperai and datasets are slow to import, they are only loaded once arguments are parsed
+    from delvin.dataset import load_entries
+    from delvin.fix import init_predictions_folder
+    from delvin.log import configure_logs
+    from delvin.predictions import get_prediction, summarize_gating
+    from delvin.prepare import prepare
+    from delvin.routing import RoutingConfig, configure_routing, router
+    from delvin.workspaces import WorkspaceManager
+
+    configure_logs(
+        verbosity=args.log_verbosity, max_field_chars=args.log_max_field_chars
+    )
+    if args.routing_config is not None:
+        with open(args.routing_config, "r") as config_file:
+            configure_routing(RoutingConfig.model_validate_json(config_file.read()))
+    predictions_directory = f"{args.root_path}/predictions"
     init_predictions_folder(predictions_directory)
-    dataset = load_dataset(args.dataset_name)
-    await fix_entries(dataset, args.split, overwrite=False, batch_size=25)
+    entries = load_entries(
+        args.dataset_name,
+        args.split,
+        instance_ids=args.instance_ids,
+        repos=args.repos,
+        start=args.start,
+        end=args.end,
+    )
+    quota_bytes = None
+    if args.workspace_quota_gb is not None:
+        quota_bytes = int(args.workspace_quota_gb * 2**30)
+    workspaces = WorkspaceManager(args.root_path, quota_bytes=quota_bytes)
+    if args.command == "prepare":
+        await prepare(
+            entries,
+            args.root_path,
+            workspaces,
+            attempts=args.attempts,
+            workers=args.prepare_workers,
+        )
+        return
+    # Prepared workspaces of the instances left to fix are only evicted once they have been used
+    workspaces.hold(
+        [
+            entry.instance_id
+            for entry in entries
+            if get_prediction(entry.instance_id, predictions_directory) is None
+        ]
+    )
+    try:
+        await fix_entries(entries, args, workspaces, overwrite=False, batch_size=25)
+    finally:
+        await workspaces.close()
+    print(summarize_gating(predictions_directory))
+    print(router.summary())
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))